@@ -0,0 +1,57 @@
+import sys
+import argparse
+from benchmarks.report import build_report, save_report, load_report, compare_reports, format_report, format_comparison
+
+
+# python -m benchmarks run [--skip-pipeline] [--skip-startup] [--output report.json]
+# python -m benchmarks compare baseline.json current.json [--tolerance 10]
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of the webhook-to-reminder pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmarks and save a report')
+    run.add_argument('--size', type=int, default=10000, help='generated messages per micro-benchmark')
+    run.add_argument('--rounds', type=int, default=5)
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--skip-micro', action='store_true')
+    run.add_argument('--skip-pipeline', action='store_true')
+    run.add_argument('--skip-startup', action='store_true')
+    run.add_argument('--startup-rounds', type=int, default=5, help='cold starts per service')
+    run.add_argument('--webhooks', type=int, default=1000)
+    run.add_argument('--events-per-webhook', type=int, default=1)
+    run.add_argument('--concurrency', type=int, default=16)
+    run.add_argument('--users', type=int, default=200)
+    run.add_argument('--line-latency', type=float, default=0.0, help='seconds added by the fake LINE API per call')
+    run.add_argument('--serving', choices=['sync', 'async'], default='sync', help='linebot_service on Flask threads or the ASGI app')
+    run.add_argument('--output', help='report path, defaults to benchmarks/results/<commit>.json')
+
+    compare = commands.add_parser('compare', help='compare two saved reports')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=10.0, help='percent change counted as a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        baseline, current = load_report(args.baseline), load_report(args.current)
+        rows = compare_reports(baseline, current, args.tolerance)
+        print(format_comparison(baseline, current, rows))
+        return 1 if any(row[4] for row in rows) else 0
+
+    micro = pipeline = startup = None
+    if not args.skip_micro:
+        from benchmarks.micro import run_micro
+        micro = run_micro(args.size, args.rounds, args.seed)
+    if not args.skip_pipeline:
+        from benchmarks.loadgen import run_pipeline
+        pipeline = run_pipeline(args.webhooks, args.concurrency, args.users, args.events_per_webhook, args.line_latency, args.seed, serving=args.serving)
+    if not args.skip_startup:
+        from benchmarks.startup import run_startup
+        startup = run_startup(args.startup_rounds, serving=args.serving)
+    report = build_report(micro, pipeline, {key: value for key, value in vars(args).items() if key not in ('command', 'output')}, startup)
+    path = save_report(report, args.output)
+    print(format_report(report))
+    print(f"saved {path}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
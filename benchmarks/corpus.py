@@ -0,0 +1,96 @@
+import random
+
+# Generated corpus of reminder messages for the benchmarks, covering every hour_min_pattern type
+# of nlp_service plus the m/d date form. The same seed always gives the same corpus, so results
+# of different commits are measured on identical input.
+digits = '零一二三四五六七八九'
+weekdays = '一二三四五六日天'
+week_prefixes = ['這週', '這禮拜', '這星期', '下週', '下禮拜', '下星期', '每週', '每個禮拜', '每星期']
+day_words = ['今天', '明天', '後天', '大後天']
+meridiems = ['早上', '上午', '中午', '下午', '晚上', '凌晨', '半夜', 'am', 'pm', 'AM', 'PM']
+openers = ['提醒我', '提醒 ', '我', '記得提醒我', '提醒 @小明', '提醒 @阿華 ']
+tasks = ['幫貓洗澡', '開會', '繳電話費', '打掃房間', '跟朋友吃飯', '倒垃圾', '交報告', '看牙醫', '運動', '收包裹',
+         '關瓦斯', '打電話給媽媽', '買牛奶', '去銀行', '寫日記', 'review PR', '帶hona散步', '澆花']
+endings = ['', '。', '！', ' ~', '～', '!!']
+pattern_types = ['datetime', 'time', 'mix_half_time', 'mix_time', 'chinese_half_time', 'chinese_time',
+                 'mix_relative_time', 'chinese_relative_time']
+
+
+def chinese_number(n):
+    if n < 10:
+        return digits[n]
+    tens, ones = divmod(n, 10)
+    return ('' if tens == 1 else digits[tens]) + '十' + (digits[ones] if ones else '')
+
+def day_prefix(rng):
+    choice = rng.random()
+    if choice < 0.4:
+        return ''
+    if choice < 0.7:
+        return rng.choice(day_words)
+    return rng.choice(week_prefixes) + rng.choice(weekdays)
+
+def meridiem(rng):
+    return rng.choice(meridiems) if rng.random() < 0.5 else ''
+
+# one time phrase of the given pattern type
+def time_phrase(rng, pattern_type):
+    hour, minute = rng.randint(1, 12), rng.randint(0, 59)
+    if pattern_type == 'datetime':
+        suffix = rng.choice(['', 'am', 'pm', ' AM', ' PM'])
+        return f"{day_prefix(rng)} {meridiem(rng) if not suffix else ''}{hour}:{minute:02d}{suffix}"
+    if pattern_type == 'time':
+        return f"{day_prefix(rng)} {hour} {rng.choice(['am', 'pm', 'AM', 'PM'])}"
+    if pattern_type == 'mix_half_time':
+        return f"{day_prefix(rng)}{meridiem(rng)}{hour}點半"
+    if pattern_type == 'mix_time':
+        return f"{day_prefix(rng)}{meridiem(rng)}{hour}點" + (f"{minute:02d}分" if rng.random() < 0.5 else '')
+    if pattern_type == 'chinese_half_time':
+        return f"{day_prefix(rng)}{meridiem(rng)}{chinese_number(hour)}點半"
+    if pattern_type == 'chinese_time':
+        return f"{day_prefix(rng)}{meridiem(rng)}{chinese_number(hour)}點" + (f"{chinese_number(minute)}分" if rng.random() < 0.5 else '')
+    unit = rng.choice(['分鐘', '小時', '天', '日'])
+    amount = rng.randint(1, 59 if unit == '分鐘' else 23)
+    count = rng.choice(['', '個'])
+    if pattern_type == 'mix_relative_time':
+        return f"{amount}{count}{unit}後"
+    return f"{chinese_number(amount)}{count}{unit}後"
+
+def message(rng, pattern_type):
+    date = f"{rng.randint(1, 12)}/{rng.randint(1, 28)} " if pattern_type == 'datetime' and rng.random() < 0.3 else ''
+    return f"{rng.choice(openers)} {date}{time_phrase(rng, pattern_type)} {rng.choice(tasks)}{rng.choice(endings)}"
+
+# size messages, spread evenly over the pattern types, plus a share of messages without a time
+def generate_messages(size=10000, seed=42, chatter=0.1):
+    rng = random.Random(seed)
+    messages = []
+    for i in range(size):
+        if rng.random() < chatter:
+            messages.append(rng.choice(['你好', '謝謝', '早安', '哈哈', '今天天氣不錯', '晚點再說']))
+        else:
+            messages.append(message(rng, pattern_types[i % len(pattern_types)]))
+    return messages
+
+def generate_day_args(size=10000, seed=42):
+    rng = random.Random(seed)
+    args = []
+    for _ in range(size):
+        if rng.random() < 0.4:
+            args.append((rng.choice(day_words[1:]), None, rng.randint(0, 6)))
+        else:
+            args.append((rng.choice(week_prefixes), rng.choice(weekdays), rng.randint(0, 6)))
+    return args
+
+def generate_overflow_args(size=10000, seed=42):
+    rng = random.Random(seed)
+    args = []
+    for _ in range(size):
+        if rng.random() < 0.2:  # repeating reminders keep day and month as *
+            args.append((str(rng.randint(0, 59)), str(rng.randint(0, 23)), '*', '*'))
+        else:
+            args.append((str(rng.randint(0, 60 * 24 * 3)), str(rng.randint(0, 23)), str(rng.randint(1, 31)), str(rng.randint(1, 12))))
+    return args
+
+def generate_numbers(size=10000, seed=42):
+    rng = random.Random(seed)
+    return [chinese_number(rng.randint(0, 99)) for _ in range(size)]
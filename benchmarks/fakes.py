@@ -0,0 +1,73 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the LINE Messaging API, services reach it through LINE_API_ENDPOINT.
+# Answers profile, reply, push and multicast calls after `latency` seconds, the way the real
+# API adds a network round trip, and records when each reply token was answered so the load
+# generator can measure webhook-to-reply latency.
+class FakeLineApi:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.replies = {}  # reply token -> perf_counter time of the reply
+        self.stats = {'profile': 0, 'reply': 0, 'push': 0, 'multicast': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-line', daemon=True)
+
+    @property
+    def endpoint(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name, reply_token=None):
+        with self.lock:
+            self.stats[name] += 1
+            if reply_token:
+                self.replies[reply_token] = time.perf_counter()
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                time.sleep(fake.latency)
+                if self.path.startswith('/v2/bot/profile/'):
+                    user_id = self.path.rsplit('/', 1)[1]
+                    fake.count('profile')
+                    return self.respond({'userId': user_id, 'displayName': f'user {user_id[-4:]}'})
+                self.send_error(404)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                time.sleep(fake.latency)
+                kind = self.path.rsplit('/', 1)[1]
+                if kind not in ('reply', 'push', 'multicast'):
+                    return self.send_error(404)
+                fake.count(kind, body.get('replyToken'))
+                self.respond({})
+
+        return Handler
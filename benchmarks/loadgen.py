@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import base64
+import socket
+import hashlib
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from benchmarks.corpus import generate_messages
+from benchmarks.fakes import FakeLineApi
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fake_modules = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_modules')
+channel_secret = 'benchmark-secret'
+services = ['nlp_service', 'user_data_service', 'reminder_service', 'linebot_service']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {f'p{p}_ms': values[min(len(values) - 1, len(values) * p // 100)] * 1000 for p in (50, 95, 99)}
+
+def sign(body):
+    return base64.b64encode(hmac.new(channel_secret.encode(), body.encode(), hashlib.sha256).digest()).decode()
+
+def webhook_body(events):
+    return json.dumps({'destination': 'Ubenchmark', 'events': events}, ensure_ascii=False)
+
+def message_event(user_id, text):
+    return {'type': 'message', 'mode': 'active', 'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': user_id}, 'replyToken': uuid.uuid4().hex,
+            'webhookEventId': uuid.uuid4().hex, 'deliveryContext': {'isRedelivery': False},
+            'message': {'id': uuid.uuid4().hex[:18], 'type': 'text', 'text': text}}
+
+
+# The four services run as local processes on free ports, wired to each other through their
+# *_SERVICE_URL settings. LINE is replaced by FakeLineApi, Google Sheets by the SQLite user
+# store and Cloud Scheduler by fake_modules/google/cloud/scheduler_v1.py.
+# serving='async' runs linebot_service as the ASGI app (asgi.py) under uvicorn instead of Flask.
+class LocalStack:
+    def __init__(self, line_endpoint, env=None, serving='sync'):
+        self.serving = serving
+        self.workdir = tempfile.mkdtemp(prefix='linebot-bench-')
+        self.ports = {service: free_port() for service in services}
+        self.env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, fake_modules]),
+                        CHANNEL_SECRET=channel_secret, CHANNEL_ACCESS_TOKEN='benchmark-token',
+                        LINE_API_ENDPOINT=line_endpoint,
+                        USER_STORE='sqlite', USER_DB_PATH=os.path.join(self.workdir, 'users.db'),
+                        REMINDER_DB_PATH=os.path.join(self.workdir, 'reminders.db'),
+                        NLP_SERVICE_URL=self.url('nlp_service'),
+                        USER_DATA_SERVICE_URL=self.url('user_data_service'),
+                        REMINDER_SERVICE_URL=self.url('reminder_service'))
+        self.env.update(env or {})
+        self.processes = []
+
+    def url(self, service):
+        return f'http://127.0.0.1:{self.ports[service]}'
+
+    def launch(self, service, log):
+        command = f"import app; app.app.run(host='127.0.0.1', port={self.ports[service]}, threaded=True)"
+        if service == 'linebot_service' and self.serving == 'async':
+            command = f"import asgi, uvicorn; uvicorn.run(asgi.app, host='127.0.0.1', port={self.ports[service]}, log_level='warning')"
+        process = subprocess.Popen([sys.executable, '-c', command], cwd=os.path.join(root, service),
+                                   env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start(self, timeout=30):
+        log = open(os.path.join(self.workdir, 'services.log'), 'w')
+        for service in services:
+            self.launch(service, log)
+        deadline = time.monotonic() + timeout
+        for service in services:
+            while True:
+                try:
+                    if requests.get(f'{self.url(service)}/metrics', timeout=1).status_code == 200:
+                        break
+                except requests.ConnectionError:
+                    pass
+                if time.monotonic() > deadline:
+                    self.stop(keep_logs=True)
+                    raise RuntimeError(f'{service} did not start, see {log.name}')
+                time.sleep(0.1)
+        return self
+
+    def stop(self, keep_logs=False):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait(10)
+        if not keep_logs:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# Send `webhooks` signed webhooks (events_per_webhook message events each, from `users`
+# distinct users) to /callback from `concurrency` threads, then wait until linebot_service has
+# processed every event. Reports the webhook ack latency, the webhook-to-reply latency seen
+# by the fake LINE API and the end-to-end event throughput.
+def run_load(callback_url, stats_url, fake_line, webhooks=1000, concurrency=16, users=200, events_per_webhook=1, seed=42, timeout=120):
+    texts = generate_messages(webhooks * events_per_webhook, seed)
+    user_ids = [f'U{uuid.UUID(int=i + 1).hex}' for i in range(users)]
+    bodies = []
+    sent_at = {}
+    for i in range(webhooks):
+        events = [message_event(user_ids[(i * events_per_webhook + j) % users], texts[i * events_per_webhook + j])
+                  for j in range(events_per_webhook)]
+        bodies.append((webhook_body(events), [event['replyToken'] for event in events]))
+
+    local = threading.local()
+    lock = threading.Lock()
+    ack_latencies = []
+    statuses = {}
+
+    def send(item):
+        body, reply_tokens = item
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        for token in reply_tokens:
+            sent_at[token] = start
+        response = local.session.post(callback_url, data=body.encode(), timeout=30,
+                                      headers={'Content-Type': 'application/json', 'X-Line-Signature': sign(body)})
+        with lock:
+            ack_latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    submitted = requests.get(stats_url, timeout=5).json()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, bodies))
+    send_duration = time.perf_counter() - start
+
+    expected = webhooks * events_per_webhook
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = requests.get(stats_url, timeout=5).json()
+        done = stats['processed'] + stats['failed'] - submitted['processed'] - submitted['failed']
+        if done >= stats['submitted'] - submitted['submitted'] and stats['queued'] == 0:
+            break
+        time.sleep(0.05)
+    total_duration = time.perf_counter() - start
+
+    reply_latencies = [fake_line.replies[token] - sent_at[token] for token in sent_at if token in fake_line.replies]
+    return {'webhooks': webhooks, 'events': expected, 'concurrency': concurrency, 'users': users,
+            'statuses': {str(status): count for status, count in statuses.items()},
+            'webhooks_per_sec': webhooks / send_duration,
+            'events_per_sec': expected / total_duration,
+            'ack': percentiles(ack_latencies),
+            'reply': percentiles(reply_latencies),
+            'replied': len(reply_latencies),
+            'failed': stats['failed'] - submitted['failed'],
+            'line_calls': dict(fake_line.stats)}
+
+def run_pipeline(webhooks=1000, concurrency=16, users=200, events_per_webhook=1, line_latency=0.0, seed=42, env=None, serving='sync'):
+    fake_line = FakeLineApi(line_latency).start()
+    stack = LocalStack(fake_line.endpoint, env, serving).start()
+    try:
+        callback_url = f"{stack.url('linebot_service')}/callback"
+        stats_url = f"{stack.url('linebot_service')}/stats/events"
+        # warm up connections, caches and the first-request code paths
+        run_load(callback_url, stats_url, fake_line, min(50, webhooks), concurrency, users, 1, seed + 1)
+        fake_line.replies.clear()
+        fake_line.stats = dict.fromkeys(fake_line.stats, 0)
+        result = run_load(callback_url, stats_url, fake_line, webhooks, concurrency, users, events_per_webhook, seed)
+        result['line_latency_ms'] = line_latency * 1000
+        result['serving'] = serving
+        result['downstream'] = requests.get(f"{stack.url('linebot_service')}/stats/downstream", timeout=5).json()
+        return result
+    finally:
+        stack.stop()
+        fake_line.stop()
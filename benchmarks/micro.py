@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import statistics
+from datetime import datetime
+from common.calendar_tables import get_zone
+from benchmarks.corpus import generate_messages, generate_day_args, generate_overflow_args, generate_numbers
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+bench_zone = 'Asia/Taipei'
+bench_now = datetime(2024, 8, 7, 10, 5, tzinfo=get_zone(bench_zone))
+
+
+# nlp_service is a flat script directory, import its app module the way the service runs it
+def load_nlp():
+    for path in (root, os.path.join(root, 'nlp_service')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import app
+    return app
+
+# Run fn over every argument tuple `rounds` times. Reports the per-call time of the fastest and
+# the median round, plus per-call percentiles when `sample` is set (timing each call adds ~0.1us,
+# so it is only worth it for the slower functions).
+def bench(fn, args, rounds=5, sample=False):
+    round_times = []
+    call_times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for arg in args:
+            fn(*arg)
+        round_times.append(time.perf_counter() - start)
+    if sample:
+        for arg in args:
+            start = time.perf_counter()
+            fn(*arg)
+            call_times.append(time.perf_counter() - start)
+        call_times.sort()
+    result = {'calls': len(args), 'rounds': rounds,
+              'best_us': min(round_times) / len(args) * 1e6,
+              'median_us': statistics.median(round_times) / len(args) * 1e6,
+              'ops_per_sec': len(args) / min(round_times)}
+    for p in (50, 95, 99) if call_times else ():
+        result[f'p{p}_us'] = call_times[min(len(call_times) - 1, len(call_times) * p // 100)] * 1e6
+    return result
+
+def run_micro(size=10000, rounds=5, seed=42):
+    nlp = load_nlp()
+    messages = generate_messages(size, seed)
+    results = {
+        'parse_text': bench(nlp.parse_text, [(text, bench_zone, bench_now) for text in messages], rounds, sample=True),
+        'chinese_to_number': bench(nlp.chinese_to_number, [(number,) for number in generate_numbers(size, seed)], rounds),
+        'process_day': bench(nlp.process_day, generate_day_args(size, seed), rounds),
+        'time_overflow_check': bench(nlp.time_overflow_check, generate_overflow_args(size, seed), rounds),
+    }
+    # pattern matching alone, on texts rewritten the way parse_text does before matching
+    normalized = []
+    for text in messages:
+        for key, value in nlp.am_pm_dict.items():
+            text = text.replace(key, value)
+        normalized.append(text.replace('：', ':'))
+    results['match_time'] = bench(nlp.match_time, [(text,) for text in normalized], rounds)
+    # two or three reminders per message, parsed in one pass
+    multi = ['，'.join(messages[i:i + 2 + i % 2]) for i in range(0, len(messages), 3)]
+    results['parse_segments'] = bench(lambda text: list(nlp.parse_segments(text, bench_zone, bench_now)), [(text,) for text in multi], rounds, sample=True)
+    # mostly repeated texts within one minute, as in a burst of similar messages
+    nlp.cached_parse.cache_clear()
+    repeated = [(text, bench_zone, bench_now) for text in messages[:size // 10]] * 10
+    results['parse_text_cached'] = bench(nlp.parse_text_cached, repeated, rounds)
+    return results
@@ -0,0 +1,95 @@
+import os
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (metric path, True when higher is better) compared between two reports
+compared_metrics = [
+    ('micro.parse_text.best_us', False),
+    ('micro.parse_text.p95_us', False),
+    ('micro.parse_text_cached.best_us', False),
+    ('micro.match_time.best_us', False),
+    ('micro.parse_segments.best_us', False),
+    ('micro.chinese_to_number.best_us', False),
+    ('micro.process_day.best_us', False),
+    ('micro.time_overflow_check.best_us', False),
+    ('pipeline.webhooks_per_sec', True),
+    ('pipeline.events_per_sec', True),
+    ('pipeline.ack.p50_ms', False),
+    ('pipeline.ack.p99_ms', False),
+    ('pipeline.reply.p50_ms', False),
+    ('pipeline.reply.p99_ms', False),
+] + [(f'startup.{service}.{name}', False) for service in ('nlp_service', 'user_data_service', 'reminder_service', 'linebot_service')
+     for name in ('listening_ms', 'ready_ms')]
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Report of one benchmark run, saved as JSON so runs on different commits can be compared
+def build_report(micro=None, pipeline=None, params=None, startup=None):
+    return {'commit': git_commit(), 'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} cpus',
+            'params': params or {}, 'micro': micro or {}, 'pipeline': pipeline or {}, 'startup': startup or {}}
+
+def save_report(report, path=None):
+    path = path or os.path.join(root, 'benchmarks', 'results', f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return path
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+def metric(report, path):
+    value = report
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+# Rows of (metric, baseline, current, change %, regressed) for the metrics found in both reports.
+# A change worse than `tolerance` percent counts as a regression.
+def compare_reports(baseline, current, tolerance=10.0):
+    rows = []
+    for path, higher_is_better in compared_metrics:
+        before, after = metric(baseline, path), metric(current, path)
+        if before is None or after is None or before == 0:
+            continue
+        change = (after - before) / before * 100
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        rows.append((path, before, after, change, regressed))
+    return rows
+
+def format_report(report):
+    lines = [f"commit {report['commit']}  {report['created_at']}  python {report['python']}  {report['machine']}"]
+    for name, result in report['micro'].items():
+        percentile_text = ''.join(f"  {p} {result[f'{p}_us']:.1f}us" for p in ('p50', 'p95', 'p99') if f'{p}_us' in result)
+        lines.append(f"  {name:<22} {result['best_us']:9.2f}us/call  {result['ops_per_sec']:12,.0f} ops/s{percentile_text}")
+    pipeline = report['pipeline']
+    if pipeline:
+        lines.append(f"  pipeline ({pipeline.get('serving', 'sync')}): {pipeline['events']} events, concurrency {pipeline['concurrency']}, "
+                     f"LINE latency {pipeline['line_latency_ms']:.0f}ms, statuses {pipeline['statuses']}, failed {pipeline['failed']}")
+        lines.append(f"    {pipeline['webhooks_per_sec']:.0f} webhooks/s acked, {pipeline['events_per_sec']:.0f} events/s processed")
+        for name in ('ack', 'reply'):
+            lines.append(f"    {name:<6}" + ''.join(f"  {p} {value:.1f}ms" for p, value in pipeline[name].items()))
+    for service, result in report.get('startup', {}).items():
+        lines.append(f"  startup {service:<18} listening {result['listening_ms']:7.0f}ms  ready {result['ready_ms']:7.0f}ms  (max {result['ready_max_ms']:.0f}ms)")
+    return '\n'.join(lines)
+
+def format_comparison(baseline, current, rows):
+    lines = [f"{baseline['commit']} -> {current['commit']}"]
+    for path, before, after, change, regressed in rows:
+        lines.append(f"  {path:<36} {before:12.2f} {after:12.2f} {change:+7.1f}%{'  REGRESSION' if regressed else ''}")
+    return '\n'.join(lines)
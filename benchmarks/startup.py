@@ -0,0 +1,48 @@
+import os
+import time
+import statistics
+import requests
+from benchmarks.loadgen import LocalStack, services
+
+
+# Cold start of each service: a fresh process is launched as in LocalStack and polled until it
+# answers /metrics (listening, imports done and the server bound) and then /ready (clients
+# warm). Every service is started alone, `rounds` times, and the median is reported.
+# The LINE endpoint is never called during startup, so no fake LINE server is needed.
+def wait_for(url, deadline, process):
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'process exited with {process.returncode} before {url} answered')
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f'{url} did not answer in time')
+
+def start_once(service, serving, env, timeout=30):
+    stack = LocalStack('http://127.0.0.1:9', env, serving)
+    log = open(os.path.join(stack.workdir, 'services.log'), 'w')
+    try:
+        start = time.perf_counter()
+        process = stack.launch(service, log)
+        deadline = time.monotonic() + timeout
+        listening = wait_for(f'{stack.url(service)}/metrics', deadline, process)
+        ready = wait_for(f'{stack.url(service)}/ready', deadline, process)
+        return (listening - start) * 1000, (ready - start) * 1000
+    except RuntimeError as e:
+        log.flush()
+        with open(log.name) as f:
+            raise RuntimeError(f'{service}: {e}\n{f.read()}')
+    finally:
+        stack.stop()
+        log.close()
+
+def run_startup(rounds=5, serving='sync', env=None):
+    results = {}
+    for service in services:
+        listening, ready = zip(*(start_once(service, serving, env) for _ in range(rounds)))
+        results[service] = {'rounds': rounds, 'listening_ms': statistics.median(listening), 'ready_ms': statistics.median(ready),
+                            'ready_max_ms': max(ready)}
+    return results
@@ -0,0 +1,52 @@
+from datetime import date
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Calendar and timezone helpers shared by nlp_service, user_data_service and the local scheduler.
+# Zones are zoneinfo objects (correct DST transitions, no localize/normalize dance as with pytz),
+# looked up once per name. Month lengths and day-of-year offsets are precomputed for common and
+# leap years, so an overflowed date (e.g. 8/31 + 40 hours) is normalized with table lookups.
+
+# Names users can type instead of an IANA zone, e.g. 切換時區 美東
+timezone_aliases = {"台灣": "Asia/Taipei", "美東": "America/New_York", "美西": "America/Los_Angeles", "日本": "Asia/Tokyo"}
+
+def resolve_timezone(name):
+    return timezone_aliases.get(name, name)
+
+# Unknown names raise ZoneInfoNotFoundError (a KeyError), malformed ones ValueError.
+# Only found zones are cached, there are a few hundred of them at most.
+@lru_cache(maxsize=None)
+def get_zone(name):
+    return ZoneInfo(name)
+
+
+# Tables indexed by [is_leap][month] with month 1-12, index 0 unused
+month_lengths = ((0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31),
+                 (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31))
+# days of the year before the 1st of the month
+days_before_month = tuple(tuple(sum(lengths[1:month]) for month in range(13)) for lengths in month_lengths)
+year_lengths = (365, 366)
+# (month, day) of every day of the year, indexed by [is_leap][day_of_year] with day_of_year from 1
+month_day_of_year = tuple(((0, 0),) + tuple((month, day) for month in range(1, 13) for day in range(1, lengths[month] + 1))
+                          for lengths in month_lengths)
+
+def is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def days_in_month(year, month):
+    return month_lengths[is_leap(year)][month]
+
+# Carry minutes into hours, hours into days, days into months and months into years.
+# Returns (year, month, day, hour, minute). Offsets that leave the year (or go below day 1)
+# go through the proleptic ordinal instead of the tables, still without any loop.
+def normalize_date(year, month, day, hour=0, minute=0):
+    hour, minute = hour + minute // 60, minute % 60
+    day, hour = day + hour // 24, hour % 24
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    leap = is_leap(year)
+    day_of_year = days_before_month[leap][month] + day
+    if 0 < day_of_year <= year_lengths[leap]:
+        month, day = month_day_of_year[leap][day_of_year]
+        return year, month, day, hour, minute
+    moved = date.fromordinal(date(year, 1, 1).toordinal() + day_of_year - 1)
+    return moved.year, moved.month, moved.day, hour, minute
@@ -0,0 +1,153 @@
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from flask import request, g, Response
+from prometheus_client import Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
+# Shared instrumentation for the four services: request and downstream duration histograms,
+# parse counters, cache/pool/queue gauges served at /metrics, and a correlation id that is
+# read from / forwarded in the X-Correlation-ID header so one message can be followed from
+# the webhook to the push.
+CORRELATION_HEADER = 'X-Correlation-ID'
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time spent serving HTTP requests',
+                             ['service', 'route', 'method', 'status'])
+DOWNSTREAM_DURATION = Histogram('downstream_request_duration_seconds', 'Time spent in calls to other services and APIs',
+                                ['service', 'downstream', 'operation', 'outcome'])
+PARSE_DURATION = Histogram('parse_duration_seconds', 'Time spent in parse_text and parse_segments by matched pattern type', ['pattern_type'],
+                           buckets=(.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .05))
+PARSE_TOTAL = Counter('parse_total', 'parse_text and parse_segments calls by matched pattern type', ['pattern_type'])
+
+correlation_id_var = contextvars.ContextVar('correlation_id', default=None)
+service_name = {'name': 'unknown'}
+
+
+def current_correlation_id():
+    return correlation_id_var.get()
+
+def set_correlation_id(correlation_id=None):
+    correlation_id = correlation_id or uuid.uuid4().hex
+    correlation_id_var.set(correlation_id)
+    return correlation_id
+
+# headers to forward on a call to another service
+def correlation_headers(headers=None):
+    headers = dict(headers or {})
+    correlation_id = current_correlation_id()
+    if correlation_id:
+        headers.setdefault(CORRELATION_HEADER, correlation_id)
+    return headers
+
+def observe_downstream(downstream, operation, outcome, elapsed):
+    DOWNSTREAM_DURATION.labels(service_name['name'], downstream, operation, outcome).observe(elapsed)
+
+@contextmanager
+def time_downstream(downstream, operation):
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        observe_downstream(downstream, operation, outcome, time.perf_counter() - start)
+
+def observe_parse(pattern_type, elapsed):
+    pattern_type = pattern_type or 'none'
+    PARSE_TOTAL.labels(pattern_type).inc()
+    PARSE_DURATION.labels(pattern_type).observe(elapsed)
+
+
+# Gauges read on scrape from stats functions returning (nested) dicts of numbers
+class StatsCollector:
+    def __init__(self):
+        self.sources = []
+
+    def add(self, component, stats):
+        self.sources.append((component, stats))
+
+    def collect(self):
+        family = GaugeMetricFamily('component_stat', 'Cache, pool and queue statistics', labels=['service', 'component', 'stat'])
+        for component, stats in self.sources:
+            try:
+                values = flatten(stats())
+            except Exception as e:
+                print(f"Error collecting {component} stats: {e}")
+                continue
+            for stat, value in values.items():
+                family.add_metric([service_name['name'], component, stat], value)
+        yield family
+
+def flatten(stats, prefix=''):
+    values = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{prefix}{key}_'))
+        elif isinstance(value, bool):
+            values[f'{prefix}{key}'] = float(value)
+        elif isinstance(value, (int, float)):
+            values[f'{prefix}{key}'] = value
+    return values
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+def register_stats(component, stats):
+    stats_collector.add(component, stats)
+
+
+# Time every request of a Flask app, propagate the correlation id and serve /metrics
+def instrument_app(app, service):
+    service_name['name'] = service
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        g.correlation_id = set_correlation_id(request.headers.get(CORRELATION_HEADER))
+
+    @app.after_request
+    def finish_request(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        if route != '/metrics' and 'request_start' in g:
+            REQUEST_DURATION.labels(service, route, request.method, response.status_code).observe(time.perf_counter() - g.request_start)
+        if 'correlation_id' in g:
+            response.headers[CORRELATION_HEADER] = g.correlation_id
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST)
+
+
+# Same for an ASGI app (the asyncio serving mode of linebot_service): wraps the app, times
+# requests by path, propagates the correlation id and answers /metrics itself
+def instrument_asgi(app, service):
+    service_name['name'] = service
+
+    async def instrumented(scope, receive, send):
+        if scope['type'] != 'http':
+            return await app(scope, receive, send)
+        if scope['path'] == '/metrics':
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', CONTENT_TYPE_LATEST.encode())]})
+            return await send({'type': 'http.response.body', 'body': generate_latest(REGISTRY)})
+
+        headers = dict(scope['headers'])
+        correlation_id = set_correlation_id(headers.get(CORRELATION_HEADER.lower().encode(), b'').decode() or None)
+        start = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_with_correlation_id(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(CORRELATION_HEADER.encode(), correlation_id.encode())]
+            await send(message)
+
+        try:
+            await app(scope, receive, send_with_correlation_id)
+        finally:
+            route = scope['path'] if status['code'] != 404 else 'unmatched'
+            REQUEST_DURATION.labels(service, route, scope['method'], status['code']).observe(time.perf_counter() - start)
+
+    return instrumented
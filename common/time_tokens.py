@@ -0,0 +1,21 @@
+import re
+
+# dict for chinese time and number, shared by nlp_service and the linebot pre-filter
+time_dict = {'零': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+week_dict = {'一': '0', '二': '1', '三': '2', '四': '3', '五': '4', '六': '5', '日': '6', '天': '6'}
+am_pm_dict = {'早上': 'am', '上午': 'am', '中午': 'pm', '下午': 'pm', '晚上': 'pm', '凌晨': 'am', '半夜': 'am', 'AM': 'am', 'PM': 'pm'}
+
+# Every time expression nlp_service understands (date_pattern and hour_min_pattern) contains one of
+#   點             3點, 三點半, 十點三十五分
+#   後             40分鐘後, 二十天後
+#   digit + : /    3:15, 6/22 (also the full-width ：)
+#   digit + am/pm  3 pm, 3下午 (any am_pm_dict word, they become am/pm before parsing)
+# Day words alone (明天, 每週五 with week_dict weekdays) never make a time, so they don't count.
+# A text without any of these tokens can't parse to a reminder, which one regex scan tells
+# without running the patterns.
+meridiem_tokens = sorted(set(am_pm_dict) | {'am', 'pm'}, key=len, reverse=True)
+time_token_regex = re.compile(r'點|後|\d[:：/]|\d\s*(?:' + '|'.join(map(re.escape, meridiem_tokens)) + ')')
+
+
+def has_time_token(text):
+    return time_token_regex.search(text) is not None
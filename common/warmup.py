@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+from flask import jsonify
+
+# Clients that are slow to import or build (LINE SDK, the Cloud Scheduler gRPC stack, gspread
+# and google-auth) are created on first use instead of at import, so a new pod or function
+# instance starts answering right away and never pays for clients its configuration doesn't use.
+
+
+# Stands in for the client built by factory(): attribute access builds it once (thread-safe)
+# and is passed through, e.g. LazyClient('line', make_line_api).push_message(...)
+class LazyClient:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.instance is None:
+            with self.lock:
+                if self.instance is None:
+                    self.instance = self.factory()
+        return self.instance
+
+    def built(self):
+        return self.instance is not None
+
+    def __getattr__(self, attribute):
+        return getattr(self.get(), attribute)
+
+
+# Warm-up steps run in one background thread after startup, /ready answers 503 until the
+# required ones succeeded so Kubernetes only routes traffic to warm pods. Failed required steps
+# are retried every retry_interval seconds, optional ones are tried once and never block.
+# WARM_UP=0 skips warming (e.g. a Cloud Function, which builds clients on first use).
+class Readiness:
+    def __init__(self, retry_interval=5.0):
+        self.retry_interval = retry_interval
+        self.steps = []  # (name, warm, required)
+        self.status = {}
+        self.started_at = time.monotonic()
+        self.ready_at = None
+
+    def add(self, name, warm, required=True):
+        self.steps.append((name, warm, required))
+        self.status[name] = 'pending'
+
+    def start(self, warm=None):
+        if warm is None:
+            warm = os.getenv('WARM_UP', '1') == '1'
+        if not warm:
+            for name, _, _ in self.steps:
+                self.status[name] = 'skipped'
+            self.ready_at = time.monotonic()
+            return
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        pending = list(self.steps)
+        while pending:
+            retry = []
+            for name, warm, required in pending:
+                try:
+                    warm()
+                    self.status[name] = 'ready'
+                except Exception as e:
+                    print(f"Error warming up {name}: {e}")
+                    self.status[name] = f'error: {e}'
+                    if required:
+                        retry.append((name, warm, required))
+                if self.ready_at is None and self.ready():
+                    self.ready_at = time.monotonic()
+            pending = retry
+            if pending:
+                time.sleep(self.retry_interval)
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+
+    def ready(self):
+        return all(self.status[name] in ('ready', 'skipped') for name, _, required in self.steps if required)
+
+    def report(self):
+        warm_up_seconds = self.ready_at - self.started_at if self.ready_at is not None else None
+        return {'ready': self.ready(), 'steps': dict(self.status), 'warm_up_seconds': warm_up_seconds}
+
+
+# GET /ready on a Flask app, 200 once warm and 503 before
+def add_readiness_route(app, readiness):
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        report = readiness.report()
+        return jsonify(report), 200 if report['ready'] else 503
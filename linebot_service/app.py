@@ -1,67 +1,129 @@
 import os
+import sys
 import json
+import atexit
+import signal
 import hmac
 import hashlib
 import base64
 from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
+from linebot import LineBotApi, WebhookParser
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
-import requests
+from service_client import ServiceClient
+from event_queue import EventDispatcher
+from profile_cache import ProfileCache, KnownUsers
+from classify import classify_message, event_key, segment_key
+from common.instrumentation import instrument_app, register_stats, time_downstream
+from common.warmup import LazyClient, Readiness, add_readiness_route
 
 app = Flask(__name__)
+instrument_app(app, 'linebot_service')
 
-line_bot_api = LineBotApi(os.getenv('CHANNEL_ACCESS_TOKEN'))
+# Built by the background warm-up (or the first webhook), the linebot models stay imported above
+# because every webhook needs them
+line_bot_api = LazyClient('line', lambda: LineBotApi(os.getenv('CHANNEL_ACCESS_TOKEN'), endpoint=os.getenv('LINE_API_ENDPOINT', 'https://api.line.me')))
 channel_secret = os.getenv('CHANNEL_SECRET')
-handler = WebhookHandler(channel_secret)
+parser = LazyClient('webhook_parser', lambda: WebhookParser(channel_secret))
 
-NLP_SERVICE_URL = "http://nlp-service:5000"
-REMINDER_SERVICE_URL = "http://reminder-service:5000"
-USER_DATA_SERVICE_URL = "http://user-data-service:5000"
+NLP_SERVICE_URL = os.getenv('NLP_SERVICE_URL', "http://nlp-service:5000")
+REMINDER_SERVICE_URL = os.getenv('REMINDER_SERVICE_URL', "http://reminder-service:5000")
+USER_DATA_SERVICE_URL = os.getenv('USER_DATA_SERVICE_URL', "http://user-data-service:5000")
+
+# One pooled client per downstream service, (connect, read) timeouts in seconds
+DOWNSTREAM_TIMEOUT = (float(os.getenv('DOWNSTREAM_CONNECT_TIMEOUT', '2')), float(os.getenv('DOWNSTREAM_READ_TIMEOUT', '5')))
+nlp_client = ServiceClient('nlp_service', NLP_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT)
+reminder_client = ServiceClient('reminder_service', REMINDER_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT)
+user_data_client = ServiceClient('user_data_service', USER_DATA_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT)
+for downstream_client in (nlp_client, reminder_client, user_data_client):
+    register_stats(downstream_client.name, downstream_client.metrics)
 
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        events = parser.parse(body, signature)
     except InvalidSignatureError:
         abort(400)
+    # Ack LINE right away, the events are processed by the dispatcher workers.
+    # The batch is queued whole or not at all, a redelivery never repeats already queued events
+    if not event_dispatcher.submit_all([(event_key(event), event) for event in events]):
+        abort(503)  # queue is full, let LINE redeliver later
     return 'OK'
 
+@app.route("/stats/downstream", methods=['GET'])
+def downstream_stats():
+    return {client.name: client.metrics() for client in (nlp_client, reminder_client, user_data_client)}
+
+@app.route("/stats/events", methods=['GET'])
+def event_stats():
+    return event_dispatcher.metrics()
+
+def fetch_display_name(user_id):
+    with time_downstream('line', 'get_profile'):
+        return line_bot_api.get_profile(user_id).display_name
+
+# Display names are cached, LINE is only asked on first contact or after PROFILE_CACHE_TTL
+profile_cache = ProfileCache(fetch_display_name, ttl=int(os.getenv('PROFILE_CACHE_TTL', '3600')),
+                             negative_ttl=int(os.getenv('PROFILE_CACHE_NEGATIVE_TTL', '60')),
+                             max_size=int(os.getenv('PROFILE_CACHE_SIZE', '10000')))
+register_stats('profile_cache', profile_cache.metrics)
+known_users = KnownUsers(max_size=int(os.getenv('PROFILE_CACHE_SIZE', '10000')))
+
 def get_user_profile(user_id):
-    try:
-        profile = line_bot_api.get_profile(user_id)
-        return profile.display_name
-    except Exception as e:
-        print(f"Error fetching user profile: {e}")
-        return "Unknown User"
+    return profile_cache.get(user_id) or "Unknown User"
 
+# Get (title, timezone) of a user in one ensure call, user_data_service creates new users with
+# default values and stores the display name sent along as the title of new users or users without one.
+# The stored title already is the user's display name (or the title they chose), so the LINE
+# profile is only needed for users this replica hasn't seen with a title yet.
 def get_user_data(user_id):
-    response = requests.get(f"{USER_DATA_SERVICE_URL}/user/{user_id}")
-    if response.status_code == 200:
-        return response.json()
-    else: # If user not found, create a new user with default values
-        default_name = get_user_profile(user_id)
-        update_user_title(user_id, default_name)
-        update_user_timezone(user_id, 'Asia/Taipei')
-        return get_user_data(user_id)
+    headers = {'Content-Type': 'application/json'}
+    data = {'timezone': 'Asia/Taipei'}
+    if user_id not in known_users:
+        display_name = profile_cache.get(user_id)
+        if display_name:  # don't store the placeholder, the profile is tried again after the negative TTL
+            data['title'] = display_name
+    response = user_data_client.post(f"/user/{user_id}/ensure", json=data, headers=headers, idempotent=True, operation='ensure_user')
+    user = response.json()
+    title = user.get('title')
+    if title:
+        known_users.add(user_id)
+    return title or "Unknown User", user.get('timezone')
 
     
 def update_user_title(user_id, title):
     headers = {'Content-Type': 'application/json'}
-    response = requests.put(f"{USER_DATA_SERVICE_URL}/user/{user_id}/title", json={'title': title}, headers=headers)
+    response = user_data_client.put(f"/user/{user_id}/title", json={'title': title}, headers=headers, operation='update_title')
     return response.json()
 
 def update_user_timezone(user_id, timezone):
-    # Retrieve user default title first
+    # Default title in case the user is new, from the profile cache
     default_name = get_user_profile(user_id)
     headers = {'Content-Type': 'application/json'}
-    response = requests.put(f"{USER_DATA_SERVICE_URL}/user/{user_id}/timezone", json={'timezone': timezone, 'title': default_name}, headers=headers)
+    response = user_data_client.put(f"/user/{user_id}/timezone", json={'timezone': timezone, 'title': default_name}, headers=headers)
     return response.json()
 
-def create_scheduler_job(timezone, user_id, time_expression, subject, task, rep):
+# Extract (subject, time_expression, task, rep) using NLP service
+def parse_text(text, timezone):
+    headers = {'Content-Type': 'application/json'}
+    response = nlp_client.post("/parse", json={'text': text, 'timezone': timezone}, headers=headers, idempotent=True, operation='parse')
+    result = response.json()
+    return result.get('subject'), result.get('time_expression'), result.get('task'), result.get('rep', False)
+
+# Every reminder of a message as a list of (subject, time_expression, task, rep)
+def parse_segments(text, timezone):
     headers = {'Content-Type': 'application/json'}
+    response = nlp_client.post("/parse/segments", json={'text': text, 'timezone': timezone}, headers=headers, idempotent=True, operation='parse_segments')
+    return [(segment.get('subject'), segment.get('time_expression'), segment.get('task'), segment.get('rep', False))
+            for segment in response.json().get('segments', [])]
+
+# idempotency_key (the LINE message id) lets reminder_service recognize redelivered webhooks
+def create_scheduler_job(timezone, user_id, time_expression, subject, task, rep, idempotency_key=None):
+    headers = {'Content-Type': 'application/json'}
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
     data = {
         'timezone': timezone,
         'user_id': user_id,
@@ -70,7 +132,7 @@ def create_scheduler_job(timezone, user_id, time_expression, subject, task, rep)
         'task': task,
         'rep': rep
     }
-    response = requests.post(f"{REMINDER_SERVICE_URL}/reminder", json=data, headers=headers)
+    response = reminder_client.post("/reminder", json=data, headers=headers, idempotent=bool(idempotency_key), operation='create_reminder')
     return response.json()
 
 def delete_scheduler_job(timezone, user_id, time_expression):
@@ -80,17 +142,38 @@ def delete_scheduler_job(timezone, user_id, time_expression):
         'user_id': user_id,
         'time_expression': time_expression
     }
-    response = requests.delete(f"{REMINDER_SERVICE_URL}/reminder", json=data, headers=headers)
+    response = reminder_client.delete("/reminder", json=data, headers=headers, operation='delete_reminder')
     return response.json()
 
-@handler.add(MessageEvent, message=TextMessage)
+def handle_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+event_dispatcher = EventDispatcher(handle_event, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+atexit.register(event_dispatcher.stop)
+register_stats('event_queue', event_dispatcher.metrics)
+
+readiness = Readiness()
+readiness.add('line', line_bot_api.get)
+readiness.add('webhook_parser', parser.get)
+readiness.start()
+add_readiness_route(app, readiness)
+
 def handle_message(event):
-    user_id = event['source']['userId']
-    message_text = event['message']['text']
+    user_id = event.source.user_id
+    message_text = event.message.text
 
-    source_type = event['source']['type']
+    source_type = event.source.type
     #print(f"Source type: {source_type}")
 
+    kind = classify_message(message_text, source_type)
+    if kind is None:
+        return
+    if kind == 'unknown':
+        reply_message(event, "我不懂您的意思QAQ")
+        return
 
     # Handle users' requests to update their title or timezone
     if message_text.startswith('更改稱呼'):
@@ -103,11 +186,10 @@ def handle_message(event):
         reply_message(event, f"好的，我記住了！您的時區是 {new_timezone}")
     elif message_text.startswith('取消'): # Cancel reminder of a time
         # Create requests data for nlp-service
-        default_name = get_user_profile(user_id)
-        user_title, user_timezone = get_user_data(user_id, default_name)
+        user_title, user_timezone = get_user_data(user_id)
 
         # Extract time using NLP service
-        subject, time_expression, task, rep = parse_text(message_text, user_timezone, user_title)
+        subject, time_expression, task, rep = parse_text(message_text, user_timezone)
 
         if time_expression:
             # Delete reminder using Reminder service
@@ -118,29 +200,32 @@ def handle_message(event):
 
     else:
         # Create requests data for nlp-service
-        default_name = get_user_profile(user_id)
-        user_title, user_timezone = get_user_data(user_id, default_name)
+        user_title, user_timezone = get_user_data(user_id)
+        # Extract every (subject, time, task) of the message using NLP service, one job each
+        segments = [segment for segment in parse_segments(message_text, user_timezone) if segment[0] and segment[1] and segment[2]]
         if source_type == 'group':
-            if message_text.startswith('提醒'):
-                subject, time_expression, task, rep = parse_text(message_text, user_timezone)
-                if task and time_expression and subject:
-                    reply_message(event, f"我會記得提醒 {subject} {task} 噠！")
-                    group_id = event['source']['groupId']
-                    create_scheduler_job(user_timezone, group_id, time_expression, subject, task, rep)  
+            if message_text.startswith('提醒') and segments:
+                reply_message(event, '\n'.join(f"我會記得提醒 {subject} {task} 噠！" for subject, time_expression, task, rep in segments))
+                group_id = event.source.group_id
+                for i, (subject, time_expression, task, rep) in enumerate(segments):
+                    create_scheduler_job(user_timezone, group_id, time_expression, subject, task, rep, segment_key(event, i))
+        elif segments:
+            # Set reminders using Reminder service
+            reply_message(event, '\n'.join(f"我會記得提醒 {user_title} {task} 噠！" for subject, time_expression, task, rep in segments))
+            for i, (subject, time_expression, task, rep) in enumerate(segments):
+                create_scheduler_job(user_timezone, user_id, time_expression, user_title, task, rep, segment_key(event, i))
         else:
-            # Extract time and task using NLP service
-            subject, time_expression, task, rep = parse_text(message_text, user_timezone)
-            # print(f"Subject: {subject}, Time: {time_expression}, Task: {task}")
-
-            if task and time_expression and subject:
-                # Set reminder using Reminder service
-                reply_message(event, f"我會記得提醒 {user_title} {task} 噠！")
-                create_scheduler_job(user_timezone, user_id, time_expression, user_title, task, rep)
-            else:
-                reply_message(event, "我不懂您的意思QAQ")
+            reply_message(event, "我不懂您的意思QAQ")
 
 def reply_message(event, text):
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+    with time_downstream('line', 'reply_message'):
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+
+# Drain queued events before exiting on SIGTERM (pod shutdown)
+def shutdown(signum, frame):
+    event_dispatcher.stop()
+    sys.exit(0)
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, shutdown)
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,230 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from linebot import WebhookParser
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+from service_client import AsyncServiceClient
+from event_queue import AsyncEventDispatcher
+from profile_cache import AsyncProfileCache, KnownUsers
+from line_api import AsyncLineApi
+from classify import classify_message, event_key, segment_key
+from common.instrumentation import instrument_asgi, register_stats
+from common.warmup import LazyClient, Readiness
+
+# Asyncio serving mode of linebot_service, with the same /callback contract as app.py.
+# Run it with `python asgi.py` (or `uvicorn asgi:app`). Calls to LINE and the other services
+# are non-blocking and independent ones run concurrently. Events are processed by worker
+# coroutines instead of threads, so one process keeps many webhooks in flight.
+line_api = AsyncLineApi(os.getenv('CHANNEL_ACCESS_TOKEN'), endpoint=os.getenv('LINE_API_ENDPOINT', 'https://api.line.me'))
+parser = LazyClient('webhook_parser', lambda: WebhookParser(os.getenv('CHANNEL_SECRET')))
+
+NLP_SERVICE_URL = os.getenv('NLP_SERVICE_URL', "http://nlp-service:5000")
+REMINDER_SERVICE_URL = os.getenv('REMINDER_SERVICE_URL', "http://reminder-service:5000")
+USER_DATA_SERVICE_URL = os.getenv('USER_DATA_SERVICE_URL', "http://user-data-service:5000")
+DEFAULT_TIMEZONE = 'Asia/Taipei'
+
+DOWNSTREAM_TIMEOUT = (float(os.getenv('DOWNSTREAM_CONNECT_TIMEOUT', '2')), float(os.getenv('DOWNSTREAM_READ_TIMEOUT', '5')))
+DOWNSTREAM_POOL_SIZE = int(os.getenv('DOWNSTREAM_POOL_SIZE', '100'))
+nlp_client = AsyncServiceClient('nlp_service', NLP_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT, pool_size=DOWNSTREAM_POOL_SIZE)
+reminder_client = AsyncServiceClient('reminder_service', REMINDER_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT, pool_size=DOWNSTREAM_POOL_SIZE)
+user_data_client = AsyncServiceClient('user_data_service', USER_DATA_SERVICE_URL, timeout=DOWNSTREAM_TIMEOUT, pool_size=DOWNSTREAM_POOL_SIZE)
+for downstream_client in (nlp_client, reminder_client, user_data_client):
+    register_stats(downstream_client.name, downstream_client.metrics)
+
+async def fetch_display_name(user_id):
+    return (await line_api.get_profile(user_id))['displayName']
+
+profile_cache = AsyncProfileCache(fetch_display_name, ttl=int(os.getenv('PROFILE_CACHE_TTL', '3600')),
+                                  negative_ttl=int(os.getenv('PROFILE_CACHE_NEGATIVE_TTL', '60')),
+                                  max_size=int(os.getenv('PROFILE_CACHE_SIZE', '10000')))
+register_stats('profile_cache', profile_cache.metrics)
+known_users = KnownUsers(max_size=int(os.getenv('PROFILE_CACHE_SIZE', '10000')))
+
+async def callback(request):
+    signature = request.headers.get('X-Line-Signature', '')
+    body = (await request.body()).decode()
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        return PlainTextResponse('Bad Request', status_code=400)
+    # Ack LINE right away, the events are processed by the dispatcher workers.
+    # The batch is queued whole or not at all, a redelivery never repeats already queued events
+    if not event_dispatcher.submit_all([(event_key(event), event) for event in events]):
+        return PlainTextResponse('Service Unavailable', status_code=503)  # queue is full, let LINE redeliver later
+    return PlainTextResponse('OK')
+
+async def downstream_stats(request):
+    return JSONResponse({client.name: client.metrics() for client in (nlp_client, reminder_client, user_data_client)})
+
+async def event_stats(request):
+    return JSONResponse(event_dispatcher.metrics())
+
+# 200 once warm, 503 before, as /ready of app.py
+async def ready(request):
+    report = readiness.report()
+    return JSONResponse(report, status_code=200 if report['ready'] else 503)
+
+async def get_user_profile(user_id):
+    return await profile_cache.get(user_id) or "Unknown User"
+
+# Get (title, timezone) of a user in one ensure call, as get_user_data of app.py. The display
+# name is only fetched for users this replica hasn't seen with a title yet.
+async def get_user_data(user_id):
+    headers = {'Content-Type': 'application/json'}
+    data = {'timezone': DEFAULT_TIMEZONE}
+    if user_id not in known_users:
+        display_name = await profile_cache.get(user_id)
+        if display_name:
+            data['title'] = display_name
+    response = await user_data_client.post(f"/user/{user_id}/ensure", json=data, headers=headers, idempotent=True, operation='ensure_user')
+    user = response.json()
+    title = user.get('title')
+    if title:
+        known_users.add(user_id)
+    return title or "Unknown User", user.get('timezone')
+
+async def update_user_title(user_id, title):
+    headers = {'Content-Type': 'application/json'}
+    response = await user_data_client.put(f"/user/{user_id}/title", json={'title': title}, headers=headers, operation='update_title')
+    return response.json()
+
+async def update_user_timezone(user_id, timezone):
+    # Default title in case the user is new, from the profile cache
+    default_name = await get_user_profile(user_id)
+    headers = {'Content-Type': 'application/json'}
+    response = await user_data_client.put(f"/user/{user_id}/timezone", json={'timezone': timezone, 'title': default_name}, headers=headers)
+    return response.json()
+
+# Extract (subject, time_expression, task, rep) using NLP service
+async def parse_text(text, timezone):
+    headers = {'Content-Type': 'application/json'}
+    response = await nlp_client.post("/parse", json={'text': text, 'timezone': timezone}, headers=headers, idempotent=True, operation='parse')
+    result = response.json()
+    return result.get('subject'), result.get('time_expression'), result.get('task'), result.get('rep', False)
+
+# Every reminder of a message as a list of (subject, time_expression, task, rep)
+async def parse_segments(text, timezone):
+    headers = {'Content-Type': 'application/json'}
+    response = await nlp_client.post("/parse/segments", json={'text': text, 'timezone': timezone}, headers=headers, idempotent=True, operation='parse_segments')
+    return [(segment.get('subject'), segment.get('time_expression'), segment.get('task'), segment.get('rep', False))
+            for segment in response.json().get('segments', [])]
+
+# User data and the parse result at the same time: the text is parsed in the default timezone
+# while the user is looked up, and only parsed again if the user lives elsewhere
+async def get_user_data_and_parse(user_id, text, parse=parse_text):
+    (user_title, user_timezone), parsed = await asyncio.gather(get_user_data(user_id), parse(text, DEFAULT_TIMEZONE))
+    if user_timezone != DEFAULT_TIMEZONE:
+        parsed = await parse(text, user_timezone)
+    return user_title, user_timezone, parsed
+
+# idempotency_key (the LINE message id) lets reminder_service recognize redelivered webhooks
+async def create_scheduler_job(timezone, user_id, time_expression, subject, task, rep, idempotency_key=None):
+    headers = {'Content-Type': 'application/json'}
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
+    data = {
+        'timezone': timezone,
+        'user_id': user_id,
+        'time_expression': time_expression,
+        'subject': subject,
+        'task': task,
+        'rep': rep
+    }
+    response = await reminder_client.post("/reminder", json=data, headers=headers, idempotent=bool(idempotency_key), operation='create_reminder')
+    return response.json()
+
+async def delete_scheduler_job(timezone, user_id, time_expression):
+    headers = {'Content-Type': 'application/json'}
+    data = {
+        'timezone': timezone,
+        'user_id': user_id,
+        'time_expression': time_expression
+    }
+    response = await reminder_client.delete("/reminder", json=data, headers=headers, operation='delete_reminder')
+    return response.json()
+
+async def handle_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        await handle_message(event)
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '256'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+event_dispatcher = AsyncEventDispatcher(handle_event, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+register_stats('event_queue', event_dispatcher.metrics)
+
+readiness = Readiness()
+readiness.add('webhook_parser', parser.get)
+
+# Same replies as handle_message in app.py, the reply and the reminder change are sent together
+async def handle_message(event):
+    user_id = event.source.user_id
+    message_text = event.message.text
+    source_type = event.source.type
+
+    kind = classify_message(message_text, source_type)
+    if kind is None:
+        return
+    if kind == 'unknown':
+        await reply_message(event, "我不懂您的意思QAQ")
+        return
+
+    if message_text.startswith('更改稱呼'):
+        new_title = message_text[4:].strip()
+        await update_user_title(user_id, new_title)
+        await reply_message(event, f"好的，我記住了！我會稱呼您為 {new_title}")
+    elif message_text.startswith('切換時區'):
+        new_timezone = message_text[4:].strip()
+        await update_user_timezone(user_id, new_timezone)
+        await reply_message(event, f"好的，我記住了！您的時區是 {new_timezone}")
+    elif message_text.startswith('取消'): # Cancel reminder of a time
+        user_title, user_timezone, (subject, time_expression, task, rep) = await get_user_data_and_parse(user_id, message_text)
+        if time_expression:
+            await asyncio.gather(reply_message(event, f"好的，此項提醒已取消。"),
+                                 delete_scheduler_job(user_timezone, user_id, time_expression))
+        else:
+            await reply_message(event, "我不懂您的意思QAQ")
+    else:
+        user_title, user_timezone, segments = await get_user_data_and_parse(user_id, message_text, parse_segments)
+        # one job per (subject, time, task) of the message
+        segments = [segment for segment in segments if segment[0] and segment[1] and segment[2]]
+        if source_type == 'group':
+            if segments:
+                group_id = event.source.group_id
+                await asyncio.gather(reply_message(event, '\n'.join(f"我會記得提醒 {subject} {task} 噠！" for subject, time_expression, task, rep in segments)),
+                                     *(create_scheduler_job(user_timezone, group_id, time_expression, subject, task, rep, segment_key(event, i))
+                                       for i, (subject, time_expression, task, rep) in enumerate(segments)))
+        elif segments:
+            await asyncio.gather(reply_message(event, '\n'.join(f"我會記得提醒 {user_title} {task} 噠！" for subject, time_expression, task, rep in segments)),
+                                 *(create_scheduler_job(user_timezone, user_id, time_expression, user_title, task, rep, segment_key(event, i))
+                                   for i, (subject, time_expression, task, rep) in enumerate(segments)))
+        else:
+            await reply_message(event, "我不懂您的意思QAQ")
+
+async def reply_message(event, text):
+    await line_api.reply_message(event.reply_token, text)
+
+# Start the workers with the server, drain queued events and close the connection pools on shutdown
+@asynccontextmanager
+async def lifespan(app):
+    event_dispatcher.start()
+    readiness.start()
+    yield
+    await event_dispatcher.stop()
+    for client in (nlp_client, reminder_client, user_data_client, line_api):
+        await client.close()
+
+routes = [
+    Route('/callback', callback, methods=['POST']),
+    Route('/stats/downstream', downstream_stats, methods=['GET']),
+    Route('/stats/events', event_stats, methods=['GET']),
+    Route('/ready', ready, methods=['GET']),
+]
+app = instrument_asgi(Starlette(routes=routes, lifespan=lifespan), 'linebot_service')
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,25 @@
+from common.time_tokens import has_time_token
+
+
+# Cheap classification before any profile, user data or NLP call:
+# 'command' for title/timezone changes, None for group chatter (ignored without lookups),
+# 'unknown' when a reminder or cancel message has no time token so parsing can't succeed,
+# otherwise 'parse'
+def classify_message(message_text, source_type):
+    if message_text.startswith('更改稱呼') or message_text.startswith('切換時區'):
+        return 'command'
+    if source_type == 'group' and not message_text.startswith('取消'):
+        if not message_text.startswith('提醒') or not has_time_token(message_text):
+            return None
+    if not has_time_token(message_text):
+        return 'unknown'
+    return 'parse'
+
+# Events of the same user (or group/room without a user) are processed in order
+def event_key(event):
+    source = event.source
+    return getattr(source, 'user_id', None) or getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+
+# Idempotency key of the i-th reminder of a message, the first one keeps the plain message id
+def segment_key(event, i):
+    return event.message.id if i == 0 else f"{event.message.id}-{i}"
@@ -0,0 +1,182 @@
+import time
+import queue
+import asyncio
+import contextvars
+import threading
+
+_STOP = object()
+
+
+# Bounded in-process event queue drained by a pool of worker threads.
+# Events with the same key (e.g. user id) always go to the same worker, so they are processed
+# in order, while different users are processed in parallel. submit_all() queues a webhook's
+# events all or nothing: it waits up to put_timeout for room for every one of them and returns
+# False without queueing any if there still isn't, so callers can push back (LINE redelivers the
+# whole batch) instead of piling up work or processing part of a batch twice. Each event runs
+# in its own copy of the submitter's context, so context variables such as the request's
+# correlation id follow it to the worker (a Context can only be entered by one thread at a time).
+class EventDispatcher:
+    def __init__(self, process, workers=4, queue_size=100, put_timeout=1.0):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.queues = []
+        self.threads = []
+        self.lock = threading.Lock()
+        self.submit_lock = threading.Lock()  # only submitters fill the queues, room checked under it stays free
+        self.stopped = False
+        self.stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'rejected': 0}
+
+    # workers are started on first use, so they are created in the serving process after any fork
+    def start(self):
+        with self.lock:
+            if self.threads or self.stopped:
+                return
+            queues = [queue.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+            threads = [threading.Thread(target=self.run, args=(events,), name=f'event-worker-{i}', daemon=True)
+                       for i, events in enumerate(queues)]
+            for thread in threads:
+                thread.start()
+            # publish the queues before the threads, submit() only checks self.threads
+            self.queues = queues
+            self.threads = threads
+
+    def run(self, events):
+        while True:
+            event = events.get()
+            if event is _STOP:
+                events.task_done()
+                return
+            context, event = event
+            try:
+                context.run(self.process, event)
+                self.count('processed')
+            except Exception as e:
+                print(f"Error processing event: {e}")
+                self.count('failed')
+            finally:
+                events.task_done()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def submit(self, key, event):
+        return self.submit_all([(key, event)])
+
+    # items is a list of (key, event), queued in order once every worker queue has room for its share
+    def submit_all(self, items):
+        if not self.threads:
+            self.start()
+        with self.submit_lock:
+            targets = [self.queues[hash(key) % self.workers] for key, _ in items] if not self.stopped else []
+            if self.stopped or not self.wait_for_room(targets):
+                self.count('rejected', len(items))
+                return False
+            for events, (_, event) in zip(targets, items):
+                events.put_nowait((contextvars.copy_context(), event))
+        self.count('submitted', len(items))
+        return True
+
+    def wait_for_room(self, targets):
+        needed = {}
+        for events in targets:
+            needed[events] = needed.get(events, 0) + 1
+        deadline = time.monotonic() + self.put_timeout
+        while any(events.maxsize - events.qsize() < count for events, count in needed.items()):
+            if time.monotonic() >= deadline or self.stopped:
+                return False
+            time.sleep(0.005)
+        return True
+
+    # stop accepting events, let the workers finish everything already queued and exit
+    def stop(self, timeout=None):
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        for events in self.queues:
+            events.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queued'] = sum(events.qsize() for events in self.queues)
+        stats['workers'] = self.workers
+        return stats
+
+
+# EventDispatcher for the asyncio serving mode: worker coroutines instead of threads, so
+# thousands of events can wait on downstream calls at once for the cost of a task each.
+# Same contract: per-key ordering, bounded queues, submit_all() queues all events or none.
+# Must be started and used from the event loop thread.
+class AsyncEventDispatcher:
+    def __init__(self, process, workers=256, queue_size=100):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queues = []
+        self.tasks = []
+        self.stopped = False
+        self.stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'rejected': 0}
+
+    def start(self):
+        if self.tasks or self.stopped:
+            return
+        self.queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self.run(events), name=f'event-worker-{i}') for i, events in enumerate(self.queues)]
+
+    async def run(self, events):
+        while True:
+            event = await events.get()
+            if event is _STOP:
+                events.task_done()
+                return
+            context, event = event
+            try:
+                # the task copies the context current at creation, create_task(context=) needs 3.11
+                await context.run(asyncio.create_task, self.process(event))
+                self.stats['processed'] += 1
+            except Exception as e:
+                print(f"Error processing event: {e}")
+                self.stats['failed'] += 1
+            finally:
+                events.task_done()
+
+    def submit(self, key, event):
+        return self.submit_all([(key, event)])
+
+    # never waits for room, nothing else runs on the loop between the check and the puts
+    def submit_all(self, items):
+        if not self.tasks:
+            self.start()
+        targets = [self.queues[hash(key) % self.workers] for key, _ in items]
+        needed = {}
+        for events in targets:
+            needed[events] = needed.get(events, 0) + 1
+        if self.stopped or any(events.maxsize - events.qsize() < count for events, count in needed.items()):
+            self.stats['rejected'] += len(items)
+            return False
+        for events, (_, event) in zip(targets, items):
+            events.put_nowait((contextvars.copy_context(), event))
+        self.stats['submitted'] += len(items)
+        return True
+
+    # stop accepting events, let the workers finish everything already queued
+    async def stop(self, timeout=None):
+        if self.stopped:
+            return
+        self.stopped = True
+        for events in self.queues:
+            await events.put(_STOP)
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+
+    def metrics(self):
+        stats = dict(self.stats)
+        stats['queued'] = sum(events.qsize() for events in self.queues)
+        stats['workers'] = self.workers
+        return stats
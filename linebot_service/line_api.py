@@ -0,0 +1,27 @@
+import httpx
+from common.instrumentation import time_downstream
+
+
+# The two LINE Messaging API calls linebot_service makes, on an httpx.AsyncClient for the
+# asyncio serving mode (line-bot-sdk 1.x only has the blocking LineBotApi).
+# Errors raise httpx.HTTPStatusError, like LineBotApiError in the blocking SDK.
+class AsyncLineApi:
+    def __init__(self, channel_access_token, endpoint='https://api.line.me', timeout=5, pool_size=100):
+        self.client = httpx.AsyncClient(base_url=endpoint, timeout=timeout,
+                                        headers={'Authorization': f'Bearer {channel_access_token}'},
+                                        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def get_profile(self, user_id):
+        with time_downstream('line', 'get_profile'):
+            response = await self.client.get(f'/v2/bot/profile/{user_id}')
+            response.raise_for_status()
+        return response.json()
+
+    async def reply_message(self, reply_token, text):
+        with time_downstream('line', 'reply_message'):
+            response = await self.client.post('/v2/bot/message/reply',
+                                              json={'replyToken': reply_token, 'messages': [{'type': 'text', 'text': text}]})
+            response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,97 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+# LRU cache of LINE display names with a TTL, bounded to max_size users.
+# fetch(user_id) is only called on a miss or once the entry expired. Failed fetches are cached
+# as None for negative_ttl, so a user whose profile can't be read (blocked the bot, LINE down)
+# doesn't cost a LINE API call on every message.
+class ProfileCache:
+    def __init__(self, fetch, ttl=3600, negative_ttl=60, max_size=10000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user_id -> (expires_at, display name or None)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'failures': 0}
+
+    def lookup(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self.stats['misses'] += 1
+                return _MISSING
+            self.entries.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def store(self, user_id, display_name, ttl):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + ttl, display_name)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # display name of the user, None if it couldn't be fetched
+    def get(self, user_id):
+        display_name = self.lookup(user_id)
+        if display_name is not _MISSING:
+            return display_name
+        try:
+            display_name = self.fetch(user_id)
+        except Exception as e:
+            print(f"Error fetching user profile: {e}")
+            with self.lock:
+                self.stats['failures'] += 1
+            self.store(user_id, None, self.negative_ttl)
+            return None
+        self.store(user_id, display_name, self.ttl)
+        return display_name
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self.entries)
+        return stats
+
+
+# Bounded LRU set of users whose stored record already has a title. Their display name isn't
+# needed, so get_user_data sends the ensure call right away without asking LINE for the profile.
+class KnownUsers:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, user_id):
+        with self.lock:
+            self.users[user_id] = True
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+    def __contains__(self, user_id):
+        with self.lock:
+            return user_id in self.users
+
+
+# ProfileCache for the asyncio serving mode, fetch is a coroutine function
+class AsyncProfileCache(ProfileCache):
+    async def get(self, user_id):
+        display_name = self.lookup(user_id)
+        if display_name is not _MISSING:
+            return display_name
+        try:
+            display_name = await self.fetch(user_id)
+        except Exception as e:
+            print(f"Error fetching user profile: {e}")
+            with self.lock:
+                self.stats['failures'] += 1
+            self.store(user_id, None, self.negative_ttl)
+            return None
+        self.store(user_id, display_name, self.ttl)
+        return display_name
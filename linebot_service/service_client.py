@@ -0,0 +1,188 @@
+import time
+import asyncio
+import threading
+from collections import deque
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from common.instrumentation import correlation_headers, observe_downstream
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+# Shared HTTP client for one downstream service: keep-alive connection pool, per-call timeouts,
+# bounded retries with exponential backoff and a circuit breaker.
+# Only idempotent calls are retried, POST callers opt in with idempotent=True.
+class ServiceClient:
+    retry_statuses = {502, 503, 504}
+    idempotent_methods = {'GET', 'PUT', 'DELETE'}
+
+    def __init__(self, name, base_url, timeout=(2, 5), retries=2, backoff=0.2,
+                 pool_size=20, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.connect(pool_size)
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.stats = {'requests': 0, 'failures': 0, 'retries': 0, 'rejected': 0}
+        self.latencies = deque(maxlen=1000)  # seconds, most recent calls
+
+    def connect(self, pool_size):
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    # circuit breaker: closed -> open after failure_threshold consecutive failures,
+    # half-open after reset_timeout (the next call is a trial), closed again on success
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()  # let one trial call through per reset_timeout
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_result(self, ok, elapsed, operation):
+        observe_downstream(self.name, operation, 'ok' if ok else 'error', elapsed)
+        with self.lock:
+            self.stats['requests'] += 1
+            self.latencies.append(elapsed)
+            if ok:
+                self.consecutive_failures = 0
+                self.opened_at = None
+            else:
+                self.stats['failures'] += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+
+    # operation names the call in metrics (defaults to the method), the current correlation id
+    # is forwarded in the request headers
+    def request(self, method, path, idempotent=None, timeout=None, operation=None, **kwargs):
+        if idempotent is None:
+            idempotent = method in self.idempotent_methods
+        operation = operation or method
+        kwargs['headers'] = correlation_headers(kwargs.get('headers'))
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            if not self.allow_request():
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.record_result(False, time.perf_counter() - start, operation)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                failed = response.status_code in self.retry_statuses
+                self.record_result(not failed, time.perf_counter() - start, operation)
+                if not failed or attempt == attempts - 1:
+                    return response
+            with self.lock:
+                self.stats['retries'] += 1
+            time.sleep(self.backoff * (2 ** attempt))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    # connections opened vs requests sent over the pool, reused = requests - connections
+    def pool_stats(self):
+        connections = requests_sent = 0
+        for key in self.adapter.poolmanager.pools.keys():
+            pool = self.adapter.poolmanager.pools[key]
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        return {'connections': connections, 'requests': requests_sent, 'reused': requests_sent - connections}
+
+    def latency_percentiles(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {f'p{p}': latencies[min(len(latencies) - 1, len(latencies) * p // 100)] for p in (50, 95, 99)}
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['circuit'] = 'closed' if self.opened_at is None else 'open'
+        stats['pool'] = self.pool_stats()
+        stats['latency'] = self.latency_percentiles()
+        return stats
+
+
+# Same client for the asyncio serving mode (asgi.py): an httpx.AsyncClient keeps the pool of
+# keep-alive connections, retries and the circuit breaker work as in ServiceClient.
+class AsyncServiceClient(ServiceClient):
+    def connect(self, pool_size):
+        connect_timeout, read_timeout = self.timeout
+        self.session = httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                                         limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def request(self, method, path, idempotent=None, timeout=None, operation=None, **kwargs):
+        if idempotent is None:
+            idempotent = method in self.idempotent_methods
+        operation = operation or method
+        kwargs['headers'] = correlation_headers(kwargs.get('headers'))
+        if timeout:
+            kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            if not self.allow_request():
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            start = time.perf_counter()
+            try:
+                response = await self.session.request(method, path, **kwargs)
+            except httpx.TransportError:  # connection errors and timeouts
+                self.record_result(False, time.perf_counter() - start, operation)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                failed = response.status_code in self.retry_statuses
+                self.record_result(not failed, time.perf_counter() - start, operation)
+                if not failed or attempt == attempts - 1:
+                    return response
+            with self.lock:
+                self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request('DELETE', path, **kwargs)
+
+    # httpx doesn't expose per-connection counters
+    def pool_stats(self):
+        return {}
+
+    async def close(self):
+        await self.session.aclose()
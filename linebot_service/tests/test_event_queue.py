@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import contextvars
+from event_queue import EventDispatcher, AsyncEventDispatcher
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def test_multi_user_batch_is_processed_by_concurrent_workers():
+    started = threading.Barrier(3, timeout=5)
+    seen = []
+
+    def process(event):
+        started.wait()  # all three workers are inside their event's context at once
+        seen.append((event, request_id.get()))
+
+    dispatcher = EventDispatcher(process, workers=3)
+    request_id.set('webhook-1')
+    # string hashes vary per process, pick three users that land on three different workers
+    by_worker = {}
+    for key in (f'U{i}' for i in range(100)):
+        by_worker.setdefault(hash(key) % 3, key)
+    batch = [(key, key) for key in by_worker.values()]
+    assert dispatcher.submit_all(batch)
+    dispatcher.stop(timeout=5)
+
+    assert sorted(seen) == sorted((key, 'webhook-1') for key, _ in batch)
+    assert dispatcher.metrics()['processed'] == 3
+    assert dispatcher.metrics()['failed'] == 0
+
+
+def test_batch_is_rejected_whole_when_one_queue_is_full():
+    release = threading.Event()
+    seen = []
+    dispatcher = EventDispatcher(lambda event: (release.wait(5), seen.append(event)), workers=1, queue_size=2, put_timeout=0.05)
+    assert dispatcher.submit_all([('a', 1), ('a', 2)])
+    assert not dispatcher.submit_all([('b', 3), ('a', 4), ('a', 5)])
+    release.set()
+    dispatcher.stop(timeout=5)
+
+    assert seen == [1, 2]
+    assert dispatcher.metrics()['rejected'] == 3
+
+
+def test_async_batch_keeps_each_submitters_context():
+    async def scenario():
+        seen = []
+
+        async def process(event):
+            await asyncio.sleep(0)
+            seen.append((event, request_id.get()))
+
+        dispatcher = AsyncEventDispatcher(process, workers=1, queue_size=2)
+        request_id.set('webhook-1')
+        assert dispatcher.submit_all([('U1', 1), ('U2', 2)])
+        request_id.set('webhook-2')
+        assert not dispatcher.submit_all([('U3', 3), ('U1', 4)])  # the queue still holds events 1 and 2
+        await dispatcher.stop(timeout=5)
+        return seen, dispatcher.metrics()
+
+    seen, metrics = asyncio.run(scenario())
+    assert sorted(seen) == [(1, 'webhook-1'), (2, 'webhook-1')]
+    assert metrics['failed'] == 0
@@ -1,13 +1,24 @@
+import os
 import re
 from datetime import datetime, timedelta
-import pytz
+from functools import lru_cache
+from time import time as current_timestamp, perf_counter
+from zoneinfo import ZoneInfoNotFoundError
+from flask import Flask, request, jsonify
+from common.instrumentation import instrument_app, observe_parse, register_stats
+from common.time_tokens import time_dict, week_dict, am_pm_dict, meridiem_tokens, has_time_token
+from common.calendar_tables import get_zone, normalize_date
+from common.warmup import Readiness, add_readiness_route
 
+app = Flask(__name__)
+instrument_app(app, 'nlp_service')
+# nothing to warm, the patterns are compiled at import, /ready is there for uniform probes
+readiness = Readiness()
+readiness.start()
+add_readiness_route(app, readiness)
 
-# dict for chinese time and number
-time_dict = {'零': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
-week_dict = {'一': '0', '二': '1', '三': '2', '四': '3', '五': '4', '六': '5', '日': '6', '天': '6'}
-am_pm_dict = {'早上': 'am', '上午': 'am', '中午': 'pm', '下午': 'pm', '晚上': 'pm', '凌晨': 'am', '半夜': 'am', 'AM': 'am', 'PM': 'pm'}
 
+# time_dict, week_dict and am_pm_dict live in common.time_tokens, shared with the linebot pre-filter
 date_pattern = r'(\d{1,2})/(\d{1,2})'
 hour_min_pattern = [
     (r'((?:這週|這禮拜|這星期|下週|下禮拜|下星期|每週|每個禮拜|每星期)([一二三四五六日天])|今天|明天|後天|大後天)?\s*(am|pm)?\s*(\d{1,2}):(\d{2})\s*(am|pm)?', 'datetime'),  # 今天下午 3:15
@@ -20,6 +31,52 @@ hour_min_pattern = [
     (r'([零一二兩三四五六七八九十]+)個*(秒|分鐘|小時|天|日)後', 'chinese_relative_time'),  # 三十分鐘後
 ]
 
+# compile everything once at import
+subject_regex = re.compile(r'@[^ ，]+')  # Match text starting with "＠" and ending before space/comma
+trailing_punct_regex = re.compile(r'[，,、。！？!?；~～><]+$')
+
+# Literals every match of a pattern contains (at least one of them), checked with `in` before
+# the regex runs. Most messages only have one kind of time expression, so most searches are skipped.
+required_tokens = {
+    'date': ('/',),
+    'datetime': (':',),
+    'time': ('am', 'pm'),
+    'mix_half_time': ('點半',),
+    'mix_time': ('點',),
+    'chinese_half_time': ('點半',),
+    'chinese_time': ('點',),
+    'mix_relative_time': ('後',),
+    'chinese_relative_time': ('後',),
+}
+date_regex = re.compile(date_pattern)
+hour_min_regexes = [(re.compile(pattern), pattern_type, required_tokens[pattern_type]) for pattern, pattern_type in hour_min_pattern]
+
+# Returns (date_groups, date_end, pattern_type, groups, time_end), the first hour_min_pattern
+# (in list order) matching anywhere in the text wins
+def match_time(text):
+    date_groups, date_end = None, -1
+    if '/' in text:
+        date_match = date_regex.search(text)
+        if date_match:
+            date_groups, date_end = date_match.groups(), date_match.end()
+    for regex, pattern_type, tokens in hour_min_regexes:
+        if any(token in text for token in tokens):
+            match = regex.search(text)
+            if match:
+                return date_groups, date_end, pattern_type, match.groups(), match.end()
+    return date_groups, date_end, None, None, -1
+
+# Ranks and (first inner group index, number of inner groups) of the date and hour_min_pattern
+# alternatives inside segment_matcher below
+time_matcher_alternatives = [(date_pattern, 'date')] + hour_min_pattern
+time_matcher_rank = {pattern_type: rank for rank, (_, pattern_type) in enumerate(time_matcher_alternatives)}
+time_matcher_groups = {}
+group_idx = 1
+for pattern, pattern_type in time_matcher_alternatives:
+    group_count = re.compile(pattern).groups
+    time_matcher_groups[pattern_type] = (group_idx + 1, group_count)
+    group_idx += 1 + group_count
+
 # process day
 def process_day(day, weekday, now_weekday):
     addday = 0
@@ -52,222 +109,149 @@ def chinese_to_number(chinese_time):
             number += time_dict[char]
     return number
 
-def time_overflow_check(minute, hour, day, month):
+# Carry minute -> hour -> day -> month of a cron time, with the month lengths of `year`
+# (the current year by default, so Feb 29 only exists in leap years)
+def time_overflow_check(minute, hour, day, month, year=None):
     minute, hour = int(minute), int(hour)
     if day != '*' and month != '*':
         day, month = int(day), int(month)
-        if minute >= 60: # minute -> hour
-            add_hour = minute // 60
-            minute = minute % 60
-            hour = hour + add_hour
-        if hour >= 24: # hour -> day
-            add_day = hour // 24
-            hour = hour % 24
-            day = day + add_day
-        # day -> month
-        while True:
-            if month in [1, 3, 5, 7, 8, 10, 12] and day > 31:
-                day -= 31
-                month += 1
-            elif month in [4, 6, 9, 11] and day > 30:
-                day -= 30
-                month += 1
-            elif month == 2 and day > 28:
-                day -= 28
-                month += 1
-            else:
-                break
-
-            if month > 12:
-                month -= 12
+        if minute >= 60 or hour >= 24 or day > 28 or month > 12: # might overflow
+            _, month, day, hour, minute = normalize_date(year or datetime.now().year, month, day, hour, minute)
     # if 下週 or 星期 was used, then i will assume minute and hour will not be over 60 and 24
     return str(minute), str(hour), str(day), str(month)
 
 
-# Extract subject, RFC3339 Format time, task from string
-def parse_text(text, zone='America/New_York'):
-    # current time
-    time = datetime.now(pytz.timezone(zone))
+# Rule table: every hour_min_pattern type maps to an extractor over its match groups.
+# Absolute extractors return (day, weekday, hour, minute, meridiem), relative ones return a timedelta.
+# Adding a new phrasing only needs a pattern in hour_min_pattern and an extractor here.
+def meridiem_of(*aps):
+    if 'am' in aps: return 'am'
+    if 'pm' in aps: return 'pm'
+    return None
 
-    time_end_idx = -1 # for task extraction
-    rep = False
-    week = -1 # for cron expression
-    
-    for key in am_pm_dict.keys():
-        text = text.replace(key, am_pm_dict[key])
-    text = text.replace('：', ':')
-    date_match = re.search(date_pattern, text)
-    if date_match:
-        month, dday = date_match.groups()
+def extract_datetime(groups):
+    day, weekday, c_ap, hour, minute, ap = groups
+    return day, weekday, int(hour), int(minute), meridiem_of(c_ap, ap)
+
+def extract_time(groups):
+    day, weekday, hour, ap = groups
+    return day, weekday, int(hour), 0, ap
+
+def extract_mix_half_time(groups):
+    day, weekday, cap, hour = groups
+    return day, weekday, int(hour), 30, cap
+
+def extract_mix_time(groups):
+    day, weekday, cap, hour, is_min, minute = groups
+    return day, weekday, int(hour), int(minute) if is_min else 0, cap
+
+def extract_chinese_half_time(groups):
+    day, weekday, cap, hour = groups
+    return day, weekday, chinese_to_number(hour), 30, cap
+
+def extract_chinese_time(groups):
+    day, weekday, cap, hour, is_min, minute = groups
+    return day, weekday, chinese_to_number(hour), chinese_to_number(minute) if is_min else 0, cap
+
+relative_units = {'小時': 'hours', '分鐘': 'minutes', '天': 'days', '日': 'days'}  # 秒 is matched but ignored
+
+def relative_delta(duration, unit):
+    if unit in relative_units:
+        return timedelta(**{relative_units[unit]: duration})
+    return timedelta()
+
+def extract_mix_relative_time(groups):
+    duration, unit = groups
+    return relative_delta(int(duration), unit)
+
+def extract_chinese_relative_time(groups):
+    duration, unit = groups
+    return relative_delta(chinese_to_number(duration), unit)
+
+time_rules = {
+    'datetime': extract_datetime,
+    'time': extract_time,
+    'mix_half_time': extract_mix_half_time,
+    'mix_time': extract_mix_time,
+    'chinese_half_time': extract_chinese_half_time,
+    'chinese_time': extract_chinese_time,
+    'mix_relative_time': extract_mix_relative_time,
+    'chinese_relative_time': extract_chinese_relative_time,
+}
+
+# Build the reminder time from "now" and the matched groups, return (time, week)
+# week is the cron weekday for repeating reminders, -1 otherwise
+def resolve_time(now, date_groups, pattern_type, groups):
+    time = now
+    if date_groups:
+        month, dday = date_groups
         time = time.replace(day=int(dday), month=int(month))
-        time_end_idx = date_match.end()
-    #print(text)
-    for pattern, pattern_type in hour_min_pattern:
-        match = re.search(pattern, text)
-        if match:
-            groups = match.groups()
-            #print(groups)
-            time_end_idx = max(time_end_idx, match.end())
-            if pattern_type == 'datetime':
-                day, weekday, c_ap, hour, minute, ap = groups
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                if c_ap == 'am' or ap == 'am':
-                    if int(hour) == 12: time = time.replace(hour=0)
-                    else: time = time.replace(hour=int(hour))
-                elif c_ap == 'pm' or ap == 'pm':
-                    if int(hour) == 12: time = time.replace(hour=int(hour))
-                    else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                time = time.replace(minute=int(minute))
-                time = time.replace(second=0)
-
-            elif pattern_type == 'time':
-                day, weekday, hour, ap = groups
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                if ap == 'am':
-                    if int(hour) == 12: time = time.replace(hour=0)
-                    else: time = time.replace(hour=int(hour))
-                elif ap == 'pm':
-                    if int(hour) == 12: time = time.replace(hour=int(hour))
-                    else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                time = time.replace(minute=0)
-                time = time.replace(second=0)
-                #print('0')
-            elif pattern_type == 'mix_half_time':
-                day, weekday, cap, hour = groups
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                if cap == 'am' or cap == 'pm':
-                    if cap == 'am':
-                        if int(hour) == 12: time = time.replace(hour=0)
-                        else: time = time.replace(hour=int(hour))
-                    elif cap == 'pm':
-                        if int(hour) == 12: time = time.replace(hour=int(hour))
-                        else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                time = time.replace(minute=30)
-                time = time.replace(second=0)
-                #print('2')
-            elif pattern_type == 'mix_time':
-                day, weekday, cap, hour, is_min, minute = groups
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                if cap == 'am' or cap == 'pm':
-                    if cap == 'am':
-                        if int(hour) == 12: time = time.replace(hour=0)
-                        else: time = time.replace(hour=int(hour))
-                    elif cap == 'pm':
-                        if int(hour) == 12: time = time.replace(hour=int(hour))
-                        else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                if is_min:
-                    time = time.replace(minute=int(minute))
-                else:
-                    time = time.replace(minute=0)
-                time = time.replace(second=0)
-                #print('1')
-            elif pattern_type == 'chinese_half_time':
-                day, weekday, cap, hour = groups
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                hour = chinese_to_number(hour)
-                if cap == 'am' or cap == 'pm':
-                    if cap == 'am':
-                        if int(hour) == 12: time = time.replace(hour=0)
-                        else: time = time.replace(hour=int(hour))
-                    elif cap == 'pm':
-                        if int(hour) == 12: time = time.replace(hour=int(hour))
-                        else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                time = time.replace(minute=30)
-                time = time.replace(second=0)
-            elif pattern_type == 'chinese_time':
-                day, weekday, cap, hour, is_min, minute = groups
-                print(groups)
-                if weekday:
-                    if process_day(day, weekday, time.weekday()) > -1:
-                        time = time + timedelta(days=process_day(day, weekday, time.weekday()))
-                    else:
-                        rep = True
-                        week = int(week_dict[weekday])+1
-                        if week == 7: week = 0
-                hour = chinese_to_number(hour)
-                if cap == 'am' or cap == 'pm':
-                    if cap == 'am':
-                        if int(hour) == 12: time = time.replace(hour=0)
-                        else: time = time.replace(hour=int(hour))
-                    elif cap == 'pm':
-                        if int(hour) == 12: time = time.replace(hour=int(hour))
-                        else: time = time.replace(hour=int(hour) + 12)
-                else: time = time.replace(hour=int(hour))
-                if is_min:
-                    minute = chinese_to_number(minute)
-                    time = time.replace(minute=int(minute))
-                else: time = time.replace(minute=0)
-                time = time.replace(second=0)
-                #print('3')
-            elif pattern_type == 'mix_relative_time':
-                duration, unit = groups
-                duration = int(duration)
-                if unit == '小時':
-                    time = time + timedelta(hours=duration)
-                elif unit == '分鐘':
-                    time = time + timedelta(minutes=duration)
-                elif unit == '天' or unit == '日':
-                    time = time + timedelta(days=duration)
-            elif pattern_type == 'chinese_relative_time':
-                #print('10')
-                duration, unit = groups
-                duration = chinese_to_number(duration)
-                if unit == '小時':
-                    time = time + timedelta(hours=duration)
-                elif unit == '分鐘':
-                    time = time + timedelta(minutes=duration)
-                elif unit == '天' or unit == '日':
-                    time = time + timedelta(days=duration)
-            
-            break
-    if rep:
+    if not pattern_type:
+        return time, -1
+
+    extracted = time_rules[pattern_type](groups)
+    if isinstance(extracted, timedelta):
+        return time + extracted, -1
+
+    day, weekday, hour, minute, meridiem = extracted
+    addday, week = 0, -1
+    if weekday:
+        addday = process_day(day, weekday, time.weekday())
+        if addday < 0: # 每週 -> repeat every week
+            addday = 0
+            week = (int(week_dict[weekday]) + 1) % 7
+    if meridiem == 'am' and hour == 12:
+        hour = 0
+    elif meridiem == 'pm' and hour != 12:
+        hour += 12
+
+    time = time.replace(hour=hour, minute=minute, second=0)
+    if addday:
+        time = time + timedelta(days=addday)
+    return time, week
+
+
+# cron expression of the reminder time, weekly when week is a cron weekday
+def format_time_expression(time, week):
+    if week != -1:
         tt = [' '] * 9
         tt[0] = str(time.minute)
         tt[2] = str(time.hour)
         tt[4] = '*'
         tt[6] = '*'
         tt[8] = str(week)
-        time_expression = ''.join(tt)
-    else:
-        time_expression = ''.join([str(time.minute), ' ', str(time.hour), ' ', str(time.day), ' ', str(time.month), ' ', '*'])
+        return ''.join(tt)
+    return ''.join([str(time.minute), ' ', str(time.hour), ' ', str(time.day), ' ', str(time.month), ' ', '*'])
+
+# Extract subject, RFC3339 Format time, task from string
+def parse_text(text, zone='America/New_York', now=None):
+    parse_start = perf_counter()
+    # current time
+    if now is None:
+        now = datetime.now(get_zone(zone))
+
+    # no time token, nothing below can match
+    if not has_time_token(text):
+        observe_parse(None, perf_counter() - parse_start)
+        return None, None, None, False
+
+    time_end_idx = -1 # for task extraction
+    
+    for key in am_pm_dict.keys():
+        text = text.replace(key, am_pm_dict[key])
+    text = text.replace('：', ':')
+    date_groups, date_end, pattern_type, groups, match_end = match_time(text)
+    if date_groups:
+        time_end_idx = date_end
+    if pattern_type:
+        time_end_idx = max(time_end_idx, match_end)
+    time, week = resolve_time(now, date_groups, pattern_type, groups)
+    rep = week != -1
+
+    time_expression = format_time_expression(time, week)
 
     # extract subject
-    subject_match = re.search(r'@[^ ，]+', text)  # Match text starting with "＠" and ending before space/comma
+    subject_match = subject_regex.search(text)
     #print(text)
     #print(subject_match)
     
@@ -280,15 +264,231 @@ def parse_text(text, zone='America/New_York'):
 
     # extract task
     task = text[time_end_idx:].strip()
-    task = re.sub(r'[，,、。！？!?；~～><]+$', '', task)
-
+    task = trailing_punct_regex.sub('', task)
 
+    observe_parse(pattern_type, perf_counter() - parse_start)
     if time_end_idx > 0:
         return subject, time_expression, task, rep
     else:
         return None, None, None, rep
 
+# Streaming matcher for parse_segments: the am_pm_dict words and the full-width colon are part of
+# the patterns, so the text is matched as it is instead of being rewritten with str.replace.
+# Group numbers follow time_matcher_groups.
+meridiem_alternation = '(' + '|'.join(map(re.escape, meridiem_tokens)) + ')'
+segment_matcher = re.compile('|'.join(
+    f"(?=(?P<{pattern_type}>{pattern.replace('(am|pm)', meridiem_alternation).replace('):(', ')[:：](')}))"
+    for pattern, pattern_type in time_matcher_alternatives))
+# separators and connecting words left at the end of a task when another reminder follows
+segment_tail_regex = re.compile(r'(?:[\s，,、。！？!?；;~～><]|然後|還有|另外|以及|提醒我|提醒)+$')
+
+# Time expressions of the text, left to right, as (pattern_type, groups, start, end), pattern_type
+# 'date' for m/d dates. Overlapping matches (明天3點 also matches at 3點, 十二點半 as chinese_time
+# and as chinese_half_time) form one cluster, from which the best ranked pattern is kept as in
+# match_time, so a message with one time expression gets the same reading as parse_text.
+def time_spans(text):
+    best = None  # (rank, pattern_type, groups, start, end) of the open cluster
+    cluster_end = date_end = -1
+    for match in segment_matcher.finditer(text):
+        pattern_type = match.lastgroup
+        if match.start() < date_end:
+            continue  # inside a date, 6/23 下午5點 is not 23 pm
+        if best and match.start() >= cluster_end:
+            yield best[1:]
+            best = None
+        start, count = time_matcher_groups[pattern_type]
+        groups = match.group(*range(start, start + count)) if count > 1 else (match.group(start),)
+        span = (time_matcher_rank[pattern_type], pattern_type, groups, match.start(), match.end(pattern_type))
+        if pattern_type == 'date':
+            if best is None and match.start() >= date_end:
+                yield span[1:]
+                date_end = span[4]
+        elif best is None:
+            best, cluster_end = span, span[4]
+        else:
+            cluster_end = max(cluster_end, span[4])
+            if span[0] < best[0]:
+                best = span
+    if best:
+        yield best[1:]
+
+# Walk the text once and yield (subject, time_expression, task, rep) for every time expression
+# found, so one message can carry several reminders:
+#   提醒我 3點 開會，5點半 接小孩 -> (你, 0 3 ..., 開會, False), (你, 30 5 ..., 接小孩, False)
+# A task runs until the next subject (@name) or time expression (or the date before it), a subject
+# applies to its own and the following reminders. Reminders whose time can't exist (e.g. 15pm) are skipped.
+def parse_segments(text, zone='America/New_York', now=None):
+    parse_start = perf_counter()
+    if now is None:
+        now = datetime.now(get_zone(zone))
+    if not has_time_token(text):
+        observe_parse(None, perf_counter() - parse_start)
+        return
+    first_type = None  # parse metrics are labelled with the first reminder's pattern, as in parse_text
+
+    subject = '你'
+    segment = None  # (subject, date_groups, pattern_type, groups, end) of the reminder being read
+    pending_date = None  # (date_groups, start) of a date waiting for its time
+    region_start = 0
+    for pattern_type, groups, start, end in time_spans(text):
+        if pattern_type == 'date':
+            if pending_date is None:
+                pending_date = (groups, start)
+            region_end = end
+            continue
+
+        boundary = pending_date[1] if pending_date else start
+        # a subject before the next time belongs to the next reminder, the task ends before it
+        subject_match = subject_regex.search(text, region_start, boundary)
+        if segment:
+            result = finish_segment(text, now, segment, subject_match.start() if subject_match else boundary, True)
+            if result:
+                yield result
+        if subject_match:
+            subject = subject_match.group(0)
+        segment = (subject, pending_date[0] if pending_date else None, pattern_type, groups, end)
+        first_type = first_type or pattern_type
+        pending_date = None
+        region_start = end
+
+    if segment is None and pending_date:  # only a date, as in parse_text
+        subject_match = subject_regex.search(text)
+        segment = (subject_match.group(0) if subject_match else subject, pending_date[0], None, None, region_end)
+    if segment:
+        result = finish_segment(text, now, segment, len(text), False)
+        if result:
+            yield result
+    observe_parse(first_type, perf_counter() - parse_start)
+
+def finish_segment(text, now, segment, boundary, followed):
+    subject, date_groups, pattern_type, groups, end = segment
+    if groups:
+        groups = tuple(am_pm_dict.get(group, group) for group in groups)
+    try:
+        time, week = resolve_time(now, date_groups, pattern_type, groups)
+    except ValueError:
+        return None
+    task = (segment_tail_regex if followed else trailing_punct_regex).sub('', text[end:boundary].strip())
+    return subject, format_time_expression(time, week), task, week != -1
+
+# LRU cache of parse results keyed on (normalized text, zone, minute bucket of "now").
+# parse_text only depends on "now" down to the minute, so a cached result stays exact for the
+# whole bucket, and relative expressions like 40分鐘後 move on with the clock as the bucket changes.
+PARSE_CACHE_SIZE = int(os.getenv('PARSE_CACHE_SIZE', '4096'))
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def cached_parse(text, zone, minute_bucket):
+    now = datetime.fromtimestamp(minute_bucket * 60, get_zone(zone))
+    return parse_text(text, zone, now)
 
+def parse_text_cached(text, zone='America/New_York', now=None):
+    timestamp = current_timestamp() if now is None else now.timestamp()
+    return cached_parse(text.strip(), zone, int(timestamp // 60))
+
+# Same cache for parse_segments, one entry holds every reminder of the message
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def cached_segments(text, zone, minute_bucket):
+    now = datetime.fromtimestamp(minute_bucket * 60, get_zone(zone))
+    return tuple(parse_segments(text, zone, now))
+
+def parse_segments_cached(text, zone='America/New_York', now=None):
+    timestamp = current_timestamp() if now is None else now.timestamp()
+    return cached_segments(text.strip(), zone, int(timestamp // 60))
+
+def cache_stats(cached):
+    info = cached.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+
+def parse_cache_stats():
+    return cache_stats(cached_parse)
+
+register_stats('parse_cache', parse_cache_stats)
+register_stats('segments_cache', lambda: cache_stats(cached_segments))
+
+# An impossible time (e.g. 15pm) is treated as not understood by every endpoint,
+# only an unknown or malformed timezone is an invalid request
+def parse_or_not_understood(text, zone='America/New_York', now=None):
+    try:
+        return parse_text_cached(text, zone, now)
+    except ValueError:
+        return (None, None, None, False)
+
+# Parse a batch of texts, zones is either one zone for all texts or a list aligned with texts
+# "now" is resolved once per zone for the whole batch, results keep the order of texts
+def parse_many(texts, zones='America/New_York'):
+    if not isinstance(texts, list):
+        raise ValueError('texts must be a list of strings')
+    if isinstance(zones, str):
+        zones = [zones] * len(texts)
+    if not isinstance(zones, list):
+        raise ValueError('timezones must be a string or a list of strings')
+    if len(zones) != len(texts):
+        raise ValueError('texts and zones must have the same length')
+    for field, values in (('texts', texts), ('timezones', zones)):
+        for i, value in enumerate(values):
+            if not isinstance(value, str):
+                raise ValueError(f'{field}[{i}] must be a string')
+
+    now_by_zone = {}
+    for zone in set(zones):
+        now_by_zone[zone] = datetime.now(get_zone(zone))
+    results = []
+    for text, zone in zip(texts, zones):
+        results.append(parse_or_not_understood(text, zone, now_by_zone[zone]))
+    return results
+
+# 400 answer for the first of the request fields that isn't a string, None if they all are
+def invalid_string_field(**fields):
+    for name, value in fields.items():
+        if not isinstance(value, str):
+            return jsonify({'message': f'Invalid request: {name} must be a string'}), 400
+    return None
+
+def parse_result_json(result):
+    subject, time_expression, task, rep = result
+    return {'subject': subject, 'time_expression': time_expression, 'task': task, 'rep': rep}
+
+@app.route('/parse', methods=['POST'])
+def parse():
+    request_data = request.get_json()
+    text = request_data.get('text', '')
+    zone = request_data.get('timezone', 'America/New_York')
+    invalid = invalid_string_field(text=text, timezone=zone)
+    if invalid:
+        return invalid
+    try:
+        get_zone(zone)
+    except (ValueError, ZoneInfoNotFoundError) as e: # unknown or malformed timezone
+        return jsonify({'message': f'Invalid request: {e}'}), 400
+    return jsonify(parse_result_json(parse_or_not_understood(text, zone)))
+
+# Body: {"texts": [...], "timezones": [...]} or {"texts": [...], "timezone": "Asia/Taipei"}
+@app.route('/parse/batch', methods=['POST'])
+def parse_batch():
+    request_data = request.get_json()
+    texts = request_data.get('texts', [])
+    zones = request_data.get('timezones', request_data.get('timezone', 'America/New_York'))
+    try:
+        results = parse_many(texts, zones)
+    except (ValueError, ZoneInfoNotFoundError) as e: # non-string fields, length mismatch or unknown timezone
+        return jsonify({'message': f'Invalid request: {e}'}), 400
+    return jsonify({'results': [parse_result_json(result) for result in results]})
+
+
+# Every reminder in one message, body: {"text": "...", "timezone": "Asia/Taipei"}
+@app.route('/parse/segments', methods=['POST'])
+def parse_text_segments():
+    request_data = request.get_json()
+    text = request_data.get('text', '')
+    zone = request_data.get('timezone', 'America/New_York')
+    invalid = invalid_string_field(text=text, timezone=zone)
+    if invalid:
+        return invalid
+    try:
+        segments = parse_segments_cached(text, zone)
+    except (ValueError, ZoneInfoNotFoundError) as e: # unknown or malformed timezone
+        return jsonify({'message': f'Invalid request: {e}'}), 400
+    return jsonify({'segments': [parse_result_json(segment) for segment in segments]})
 
 #test_strings = '提醒 ＠多芣朗炫34打擊砲 明天下午 4點 幫貓洗澡。'
 #test_strings = '我 這禮拜天早上十點三十五分 跟朋友有約 ~'
@@ -304,4 +504,11 @@ def parse_text(text, zone='America/New_York'):
 
 
 # subject, time, task, rep = parse_text(test_strings)
-# print(f"{test_strings} -> {subject} {time} {task}")
\ No newline at end of file
+# print(f"{test_strings} -> {subject} {time} {task}")
+
+@app.route('/parse/cache', methods=['GET'])
+def parse_cache():
+    return jsonify(dict(parse_cache_stats(), segments=cache_stats(cached_segments)))
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,60 @@
+from datetime import datetime
+from app import parse_text, parse_segments
+from common.calendar_tables import get_zone
+
+
+# Parity corpus for parse_text, built from the test_strings in app.py.
+# Expected results are pinned at a fixed "now" (Wed 2024/8/7 10:05 Asia/Taipei) and record the
+# current behaviour, quirks included (e.g. 明天/後天 without a weekday keep today's date),
+# so rewrites of the parsing pipeline can be checked against it.
+corpus_zone = 'Asia/Taipei'
+corpus_now = datetime(2024, 8, 7, 10, 5, tzinfo=get_zone(corpus_zone))
+
+test_strings = [
+    ('提醒 ＠多芣朗炫34打擊砲 明天下午 4點 幫貓洗澡。', ('你', '0 16 7 8 *', '幫貓洗澡', False)),
+    ('我 這禮拜天早上十點三十五分 跟朋友有約 ~', ('你', '35 10 7 8 *', '跟朋友有約 ', False)),
+    ('我這星期一半夜兩點半 要睡覺 ~', ('你', '30 2 * * 1', '要睡覺 ', True)),
+    ('提醒我 每週五 3:15am 幫hona洗澡。', ('你', '15 3 * * 5', '幫hona洗澡', True)),
+    ('提醒我 6/22 3:15pm 打掃。', ('你', '15 15 22 6 *', '打掃', False)),
+    ('提醒我 40分鐘後 關瓦斯', ('你', '45 10 7 8 *', '關瓦斯', False)),
+    ('提醒我 二十小時後 撿五個垃圾', ('你', '5 6 8 8 *', '撿五個垃圾', False)),
+    ('提醒我 二十天後 收包裹', ('你', '5 10 27 8 *', '收包裹', False)),
+    ('提醒我 每週二 4PM 運動', ('你', '0 16 * * 2', '運動', True)),
+    ('提醒我 明天 3 pm 開會', ('你', '0 15 7 8 *', '開會', False)),
+    ('提醒我 大後天 3點半 繳費', ('你', '30 3 7 8 *', '繳費', False)),
+    ('提醒我 後天 3點15分 看牙醫', ('你', '15 3 7 8 *', '看牙醫', False)),
+    ('提醒我 這週五三點 交報告', ('你', '0 3 9 8 *', '交報告', False)),
+    ('提醒我 下週一 早上9:30 面試', ('你', '30 9 12 8 *', '面試', False)),
+    ('提醒我 下禮拜三 晚上八點 打電話', ('你', '0 20 7 8 *', '打電話', False)),
+    ('提醒 @小明 每個禮拜二 十二點半 吃飯！', ('@小明', '30 12 7 8 *', '吃飯', False)),
+    ('提醒我 12/31 11 pm 倒數', ('你', '0 23 31 12 *', '倒數', False)),
+    ('提醒我 3個小時後 關火', ('你', '5 13 7 8 *', '關火', False)),
+    ('你好', (None, None, None, False)),
+]
+
+# Messages with several reminders, every (subject, time_expression, task, rep) of parse_segments
+segment_strings = [
+    ('@小明 3點 開會 @小華 4點 吃飯', [('@小明', '0 3 7 8 *', '開會', False), ('@小華', '0 4 7 8 *', '吃飯', False)]),
+    ('提醒我 3點 開會，5點半 接小孩', [('你', '0 3 7 8 *', '開會', False), ('你', '30 5 7 8 *', '接小孩', False)]),
+    ('提醒 @小明 明天下午 4點 幫貓洗澡，然後 @小華 6/23 下午5點 繳費', [('@小明', '0 16 7 8 *', '幫貓洗澡', False), ('@小華', '0 17 23 6 *', '繳費', False)]),
+    ('提醒我 40分鐘後 關瓦斯 還有 二十小時後 倒垃圾', [('你', '45 10 7 8 *', '關瓦斯', False), ('你', '5 6 8 8 *', '倒垃圾', False)]),
+]
+
+def check_corpus():
+    mismatches = []
+    for text, expected in test_strings:
+        result = parse_text(text, corpus_zone, now=corpus_now)
+        if result != expected:
+            mismatches.append((text, expected, result))
+    for text, expected in segment_strings:
+        result = list(parse_segments(text, corpus_zone, now=corpus_now))
+        if result != expected:
+            mismatches.append((text, expected, result))
+    return mismatches
+
+if __name__ == '__main__':
+    mismatches = check_corpus()
+    for text, expected, result in mismatches:
+        print(f"{text} -> expected {expected}, got {result}")
+    total = len(test_strings) + len(segment_strings)
+    print(f"{total - len(mismatches)}/{total} parse results match")
@@ -1,14 +1,35 @@
 import os
-from flask import Flask, request
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
-from google.cloud import scheduler_v1
+import sys
+import atexit
+import signal
+from flask import Flask, request, jsonify
+from scheduler import ReminderScheduler
+from delivery import ReminderDelivery, reminder_text
+from common.instrumentation import instrument_app, register_stats, current_correlation_id, time_downstream
+from common.warmup import LazyClient, Readiness, add_readiness_route
 
 app = Flask(__name__)
+instrument_app(app, 'reminder_service')
 
-line_bot_api = LineBotApi(os.getenv('CHANNEL_ACCESS_TOKEN'))
-client = scheduler_v1.CloudSchedulerClient()
+# The LINE SDK and the Cloud Scheduler client (gRPC stack) are imported and built on first use
+# or by the background warm-up, not at import
+def make_line_bot_api():
+    from linebot import LineBotApi
+    return LineBotApi(os.getenv('CHANNEL_ACCESS_TOKEN'), endpoint=os.getenv('LINE_API_ENDPOINT', 'https://api.line.me'))
 
+def make_scheduler_client():
+    from google.cloud import scheduler_v1
+    return scheduler_v1.CloudSchedulerClient()
+
+line_bot_api = LazyClient('line', make_line_bot_api)
+client = LazyClient('cloud_scheduler', make_scheduler_client)
+
+def push_reminder(user_id, user_title, task):
+    from linebot.models import TextSendMessage
+    with time_downstream('line', 'push'):
+        line_bot_api.push_message(user_id, TextSendMessage(text=reminder_text(user_title, task)))
+
+# Cloud Scheduler target, one job per reminder
 @app.route("/", methods=['POST'])
 def send_reminder():
     request_data = request.get_json()
@@ -19,12 +40,84 @@ def send_reminder():
     job_name = request_data.get('job_name')
 
     if user_id and user_title and task:
-        line_bot_api.push_message(user_id, TextSendMessage(text=f"{user_title} 到{task}的時間囉！"))
+        push_reminder(user_id, user_title, task)
     if rep == False:
         client.delete_job(name=job_name)
     
     return 'OK', 200
+
+# Local scheduler, reminders are kept and fired by this service
+reminder_delivery = ReminderDelivery(line_bot_api, workers=int(os.getenv('DELIVERY_WORKERS', '8')),
+                                     rate=float(os.getenv('LINE_RATE_LIMIT', '1000')))
+reminder_scheduler = ReminderScheduler(reminder_delivery.deliver, os.getenv('REMINDER_DB_PATH', 'reminders.db'))
+reminder_scheduler.start()
+
+# Stop firing new reminders, then finish the sends already queued. Reminders whose send didn't
+# finish stay stored and are sent after the restart.
+def stop_delivery():
+    reminder_scheduler.stop()
+    reminder_delivery.shutdown()
+
+atexit.register(stop_delivery)
+register_stats('scheduler', reminder_scheduler.metrics)
+register_stats('delivery', reminder_delivery.metrics)
+
+# Only the LINE client is needed to serve the local scheduler, Cloud Scheduler is optional
+readiness = Readiness()
+readiness.add('line', line_bot_api.get)
+readiness.add('cloud_scheduler', client.get, required=False)
+readiness.start()
+add_readiness_route(app, readiness)
+
+# Retried requests carrying the same Idempotency-Key header (the LINE message id) or asking for
+# the same user, time, title and task get the existing reminder back with 200 instead of a duplicate
+@app.route("/reminder", methods=['POST'])
+def create_reminder():
+    request_data = request.get_json(silent=True) or {}
+    zone = request_data.get('timezone', 'Asia/Taipei')
+    for field, value in (('user_id', request_data.get('user_id')), ('time_expression', request_data.get('time_expression')), ('timezone', zone)):
+        if not isinstance(value, str) or not value:
+            return jsonify({'message': f'Invalid reminder: {field} must be a non-empty string'}), 400
+    try:
+        reminder, created = reminder_scheduler.add(request_data.get('user_id'), request_data.get('subject'), request_data.get('task'),
+                                                   request_data.get('time_expression'), zone,
+                                                   request_data.get('rep', False), request.headers.get('Idempotency-Key'),
+                                                   current_correlation_id())
+    except (ValueError, KeyError) as e:  # bad cron expression or unknown timezone
+        return jsonify({'message': f'Invalid reminder: {e}'}), 400
+    return jsonify(reminder), 201 if created else 200
+
+@app.route("/reminder", methods=['DELETE'])
+def delete_reminder():
+    request_data = request.get_json()
+    removed = reminder_scheduler.remove_at(request_data.get('user_id'), request_data.get('time_expression'))
+    return jsonify({'message': f'{len(removed)} reminder(s) deleted', 'deleted': len(removed)}), 200
+
+# Pending reminders of a user in fire order
+@app.route("/reminders/<user_id>", methods=['GET'])
+def list_reminders(user_id):
+    return jsonify({'reminders': reminder_scheduler.upcoming(user_id)})
+
+# Pending reminders of several users, body: {"user_ids": [...]}
+@app.route("/reminders", methods=['POST'])
+def list_reminders_many():
+    user_ids = (request.get_json(silent=True) or {}).get('user_ids', [])
+    return jsonify({'reminders': reminder_scheduler.upcoming_many(user_ids)})
+
+@app.route("/stats/scheduler", methods=['GET'])
+def scheduler_stats():
+    stats = reminder_scheduler.metrics()
+    stats['delivery'] = reminder_delivery.metrics()
+    return jsonify(stats)
     
 
+# Drain delivery before exiting on SIGTERM (pod shutdown)
+def shutdown(signum, frame):
+    stop_delivery()
+    sys.exit(0)
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    signal.signal(signal.SIGTERM, shutdown)
+    # The reloader would import this module in a second process, whose scheduler fires the same
+    # stored reminders without ever seeing the reminders added or deleted through the server
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,147 @@
+import calendar
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from common.calendar_tables import get_zone, days_in_month
+
+
+# Five-field cron expressions "minute hour day month weekday" as produced by nlp_service,
+# e.g. "15 3 * * 5" (every Friday 3:15) or "0 16 22 6 *" (June 22nd 16:00).
+# Fields support *, numbers, ranges a-b, lists a,b and steps */n or a-b/n. Weekday 0 is Sunday.
+# Expressions are compiled once into one bitmask per field; the next fire time is then found
+# by jumping field by field to the next set bit instead of stepping through minutes or days.
+field_ranges = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+class CronExpression:
+    def __init__(self, minutes, hours, days, months, weekdays, any_day, any_weekday):
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = weekdays
+        self.any_day = any_day
+        self.any_weekday = any_weekday
+
+    def day_matches(self, year, month, day):
+        weekday = (calendar.weekday(year, month, day) + 1) % 7  # cron counts from Sunday
+        day_match = self.days >> day & 1
+        weekday_match = self.weekdays >> weekday & 1
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+
+def parse_field(field, low, high):
+    mask = 0
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'Cron field out of range: {field}')
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+@lru_cache(maxsize=4096)
+def compile_cron(expression):
+    fields = (expression or '').split()
+    if len(fields) != 5:
+        raise ValueError(f'Cron expression needs 5 fields: {expression}')
+    minutes, hours, days, months, weekdays = [parse_field(field, low, high) for field, (low, high) in zip(fields, field_ranges)]
+    if weekdays >> 7 & 1:  # 7 is also Sunday
+        weekdays = (weekdays | 1) & ~(1 << 7)
+    return CronExpression(minutes, hours, days, months, weekdays, fields[2] == '*', fields[4] == '*')
+
+# smallest set bit of mask that is >= value, or -1
+def next_bit(mask, value):
+    mask >>= value
+    if not mask:
+        return -1
+    return value + (mask & -mask).bit_length() - 1
+
+# Next wall-clock time (naive, minute resolution) at or after `local` matching the expression
+def next_wall_time(cron, local):
+    year, month, day, hour, minute = local.year, local.month, local.day, local.hour, local.minute
+    for _ in range(8 * 12 * 32):  # Feb 29 can be 8 years away
+        next_month = next_bit(cron.months, month)
+        if next_month == -1:
+            year, month, day, hour, minute = year + 1, next_bit(cron.months, 1), 1, 0, 0
+            continue
+        if next_month != month:
+            month, day, hour, minute = next_month, 1, 0, 0
+
+        month_length = days_in_month(year, month)
+        if cron.any_weekday:  # jump straight to the next allowed day of month
+            next_day = next_bit(cron.days, day)
+        else:
+            next_day = day
+            while next_day <= month_length and not cron.day_matches(year, month, next_day):
+                next_day += 1
+        if next_day == -1 or next_day > month_length or not cron.day_matches(year, month, next_day):
+            month, day, hour, minute = month + 1, 1, 0, 0
+            if month > 12:
+                year, month = year + 1, 1
+            continue
+        if next_day != day:
+            day, hour, minute = next_day, 0, 0
+
+        next_hour = next_bit(cron.hours, hour)
+        if next_hour == -1:
+            day, hour, minute = day + 1, 0, 0
+            if day > month_length:
+                month, day = month + 1, 1
+                if month > 12:
+                    year, month = year + 1, 1
+            continue
+        if next_hour != hour:
+            hour, minute = next_hour, 0
+
+        next_minute = next_bit(cron.minutes, minute)
+        if next_minute == -1:
+            hour, minute = hour + 1, 0
+            if hour > 23:
+                day, hour = day + 1, 0
+                if day > month_length:
+                    month, day = month + 1, 1
+                    if month > 12:
+                        year, month = year + 1, 1
+            continue
+        return datetime(year, month, day, hour, next_minute)
+    return None
+
+# Next time at or after `after` (aware datetime) matching the expression in the given zone.
+# Wall times skipped by a DST jump are shifted forward by the jump, wall times repeated when
+# clocks go back fire once, on their first occurrence still ahead of `after`.
+def next_fire_time(expression, zone, after):
+    cron = compile_cron(expression)
+    tz = get_zone(zone)
+    threshold = after.timestamp() - after.second - after.microsecond / 1e6  # start of after's minute
+    local = after.astimezone(tz).replace(second=0, microsecond=0, tzinfo=None)
+    while True:
+        wall = next_wall_time(cron, local)
+        if wall is None:
+            return None
+        first = wall.replace(tzinfo=tz)
+        if first.timestamp() >= threshold:
+            return first
+        second = wall.replace(tzinfo=tz, fold=1)
+        if second.utcoffset() != first.utcoffset() and second.timestamp() >= threshold:
+            return second
+        local = wall + timedelta(minutes=1)
+
+# The next `count` fire times after `after`, e.g. for listing or capacity planning
+def fire_times(expression, zone, after, count):
+    times = []
+    fire = next_fire_time(expression, zone, after)
+    while fire is not None and len(times) < count:
+        times.append(fire)
+        fire = next_fire_time(expression, zone, fire.astimezone(timezone.utc) + timedelta(minutes=1))
+    return times
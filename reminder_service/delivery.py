@@ -0,0 +1,152 @@
+import time
+import uuid
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from common.instrumentation import time_downstream
+
+MULTICAST_LIMIT = 500  # max recipients of one LINE multicast call
+
+
+def reminder_text(user_title, task):
+    return f"{user_title} 到{task}的時間囉！"
+
+
+# Token bucket shared by all delivery threads, `rate` LINE API calls per second
+class RateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Delivery stage for reminders due in the same scheduler tick.
+# Reminders with the same text for several users become LINE multicast calls (up to
+# MULTICAST_LIMIT recipients each); the rest, including groups and rooms which multicast
+# doesn't accept, are pushed one by one. Calls run on a thread pool behind a rate limiter.
+# Transient errors (429, 5xx, connection errors and timeouts) are retried with backoff, other
+# 4xx answers are final. The outcome of every call is reported with complete(reminders, outcome)
+# ('sent', 'rejected' or 'failed'), the scheduler keeps the reminders until then and tries
+# failed ones again later. Every call carries a retry key, LINE accepts a key only once. Each
+# reminder of a failed call is tagged with batch = (kind, retry key) and the scheduler hands the
+# tag back with its retries, so the same call is repeated with the same key instead of the
+# reminders being regrouped under new keys, and a call LINE accepted before timing out isn't
+# delivered again. The tags are kept in memory, a reminder whose outcome was lost in a crash
+# may be sent again after the restart.
+class ReminderDelivery:
+    def __init__(self, line_bot_api, workers=8, rate=1000, retries=3, backoff=1.0):
+        self.line_bot_api = line_bot_api
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='delivery')
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.stats = {'pushed': 0, 'multicast': 0, 'multicast_recipients': 0, 'throttled': 0, 'retried': 0, 'rejected': 0, 'failed': 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def deliver(self, reminders, complete):
+        reminders_by_text = defaultdict(list)
+        incomplete = []
+        for reminder in reminders:
+            if reminder['user_id'] and reminder['title'] and reminder['task']:
+                reminders_by_text[reminder_text(reminder['title'], reminder['task'])].append(reminder)
+            else:
+                incomplete.append(reminder)
+        if incomplete:  # nothing to send, never will be
+            complete(incomplete, 'rejected')
+
+        futures = []
+        retries = defaultdict(list)  # reminders of failed calls, sent again as the same call
+        for text in list(reminders_by_text):
+            batch = [reminder for reminder in reminders_by_text[text] if not reminder.get('batch')]
+            for reminder in reminders_by_text[text]:
+                if reminder.get('batch'):
+                    retries[(text,) + tuple(reminder['batch'])].append(reminder)
+            reminders_by_text[text] = batch
+        for (text, kind, retry_key), batch in retries.items():
+            futures.append(self.executor.submit(self.send_batch, kind, batch, text, complete, retry_key))
+        for text, batch in reminders_by_text.items():
+            users = [reminder for reminder in batch if reminder['user_id'].startswith('U')]
+            others = [reminder for reminder in batch if not reminder['user_id'].startswith('U')]
+            if len(users) < 2:
+                others += users
+                users = []
+            for i in range(0, len(users), MULTICAST_LIMIT):
+                chunk = users[i:i + MULTICAST_LIMIT]
+                futures.append(self.executor.submit(self.send_batch, 'multicast', chunk, text, complete))
+            for reminder in others:
+                futures.append(self.executor.submit(self.send_batch, 'push', [reminder], text, complete))
+        return futures
+
+    def send_batch(self, kind, batch, text, complete, retry_key=None):
+        to = [reminder['user_id'] for reminder in batch] if kind == 'multicast' else batch[0]['user_id']
+        retry_key = retry_key or str(uuid.uuid5(uuid.NAMESPACE_OID, ','.join(f"{reminder['id']}@{reminder.get('occurrence', reminder['next_fire'])}" for reminder in batch)))
+        for reminder in batch:
+            reminder['batch'] = (kind, retry_key)
+        outcome = 'failed'
+        try:
+            outcome = self.send(kind, to, text, [reminder.get('correlation_id') for reminder in batch], retry_key)
+        finally:
+            complete(batch, outcome)
+
+    # Returns 'sent', 'rejected' or 'failed'. correlation_ids of the reminders being sent are
+    # logged with failures, for tracing them back to their webhook
+    def send(self, kind, to, text, correlation_ids=(), retry_key=None):
+        from linebot.exceptions import LineBotApiError  # the LINE SDK is loaded with the client, not at import
+        from linebot.models import TextSendMessage
+        retry_key = retry_key or str(uuid.uuid4())
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            self.limiter.acquire()
+            try:
+                with time_downstream('line', kind):
+                    if kind == 'multicast':
+                        self.line_bot_api.multicast(to, TextSendMessage(text=text), retry_key=retry_key)
+                    else:
+                        self.line_bot_api.push_message(to, TextSendMessage(text=text), retry_key=retry_key)
+                if kind == 'multicast':
+                    self.count('multicast')
+                    self.count('multicast_recipients', len(to))
+                else:
+                    self.count('pushed')
+                return 'sent'
+            except LineBotApiError as e:
+                if e.status_code == 409:  # already accepted under this retry key
+                    return 'sent'
+                if e.status_code != 429 and e.status_code < 500:  # e.g. 400, or 403 when the user blocked the bot
+                    print(f"Error sending reminder ({kind}, correlation ids {', '.join(filter(None, correlation_ids))}): {e}")
+                    self.count('rejected')
+                    return 'rejected'
+                self.count('throttled' if e.status_code == 429 else 'retried')
+                error = e
+            except Exception as e:  # connection errors and timeouts
+                self.count('retried')
+                error = e
+        print(f"Error sending reminder ({kind}, correlation ids {', '.join(filter(None, correlation_ids))}): {error}")
+        self.count('failed')
+        return 'failed'
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,251 @@
+import time
+import uuid
+import heapq
+import bisect
+import hashlib
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from cron import next_fire_time
+
+columns = ['id', 'user_id', 'title', 'task', 'time_expression', 'timezone', 'rep', 'next_fire', 'idempotency_key', 'correlation_id']
+
+
+# title and task of a reminder, in a group the same task at the same time can be for different people
+def task_hash(title, task):
+    return hashlib.sha1(f"{title or ''}\n{task or ''}".encode()).hexdigest()[:16]
+
+
+# Local reminder scheduler: a heap of (fire timestamp, reminder id) served by one timer thread,
+# persisted to SQLite so pending reminders survive restarts.
+# Reminders are dicts {'id', 'user_id', 'title', 'task', 'time_expression', 'timezone', 'rep',
+# 'next_fire', 'idempotency_key', 'correlation_id'}; the correlation id of the creating request
+# is kept so the push can be traced back to the webhook.
+# Reminders due in the same tick are handed together to dispatch(reminders, complete), and stay
+# stored (out of the heap) until dispatch reports their outcome with complete(reminders, outcome):
+# delivered or rejected ones are then advanced (repeating) or removed (one-shot), failed ones are
+# tried again after retry_delay, doubled on every attempt, up to max_attempts. Reminders that
+# failed together are retried together, with the 'batch' tag dispatch gave them. A crash or a
+# shutdown before the outcome leaves them in SQLite, so they are sent again after the restart.
+# The registry indexes every pending reminder by
+#   (user_id, time_expression, title+task hash) -> id   duplicates return the existing reminder
+#   (user_id, time_expression) -> ids             cancel by user and time without a scan
+#   idempotency key -> id                         retried requests get the same reminder back
+#   user_id -> sorted (next_fire, id)             listing in fire order
+class ReminderScheduler:
+    def __init__(self, dispatch, path='reminders.db', retry_delay=60, max_attempts=5):
+        self.dispatch = dispatch
+        self.path = path
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.in_flight = set()
+        self.attempts = {}  # id -> (failed attempts, occurrence, batch) of reminders being retried
+        self.heap = []
+        self.reminders = {}
+        self.by_task = {}
+        self.by_time = defaultdict(set)
+        self.by_idempotency_key = {}
+        self.user_fires = defaultdict(list)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS reminders (id TEXT PRIMARY KEY, user_id TEXT, title TEXT, task TEXT, '
+                          'time_expression TEXT, timezone TEXT, rep INTEGER, next_fire REAL)')
+        existing = [row[1] for row in self.conn.execute('PRAGMA table_info(reminders)')]
+        for column in ('idempotency_key', 'correlation_id'):  # databases created before these columns
+            if column not in existing:
+                self.conn.execute(f'ALTER TABLE reminders ADD COLUMN {column} TEXT')
+        self.load()
+
+    def load(self):
+        rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM reminders")
+        for row in rows:
+            reminder = dict(zip(columns, row))
+            reminder['rep'] = bool(reminder['rep'])
+            self.reminders[reminder['id']] = reminder
+            self.heap.append((reminder['next_fire'], reminder['id']))
+            self.user_fires[reminder['user_id']].append((reminder['next_fire'], reminder['id']))
+            self.register(reminder)
+        heapq.heapify(self.heap)
+        for fires in self.user_fires.values():
+            fires.sort()
+
+    def register(self, reminder):
+        self.by_task[(reminder['user_id'], reminder['time_expression'], task_hash(reminder['title'], reminder['task']))] = reminder['id']
+        self.by_time[(reminder['user_id'], reminder['time_expression'])].add(reminder['id'])
+        if reminder['idempotency_key']:
+            self.by_idempotency_key[reminder['idempotency_key']] = reminder['id']
+
+    def unregister(self, reminder):
+        self.by_task.pop((reminder['user_id'], reminder['time_expression'], task_hash(reminder['title'], reminder['task'])), None)
+        time_key = (reminder['user_id'], reminder['time_expression'])
+        self.by_time[time_key].discard(reminder['id'])
+        if not self.by_time[time_key]:
+            del self.by_time[time_key]
+        if reminder['idempotency_key']:
+            self.by_idempotency_key.pop(reminder['idempotency_key'], None)
+        self.index_remove(reminder)
+
+    def index_add(self, reminder):
+        bisect.insort(self.user_fires[reminder['user_id']], (reminder['next_fire'], reminder['id']))
+
+    def index_remove(self, reminder):
+        fires = self.user_fires[reminder['user_id']]
+        i = bisect.bisect_left(fires, (reminder['next_fire'], reminder['id']))
+        if i < len(fires) and fires[i][1] == reminder['id']:
+            del fires[i]
+        if not fires:
+            del self.user_fires[reminder['user_id']]
+
+    def save(self, reminder):
+        with self.conn:
+            self.conn.execute(f"INSERT OR REPLACE INTO reminders ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                              [int(reminder[column]) if column == 'rep' else reminder[column] for column in columns])
+
+    def delete(self, reminder_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM reminders WHERE id = ?', (reminder_id,))
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='reminder-scheduler', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+
+    def existing(self, user_id, title, task, time_expression, idempotency_key):
+        reminder_id = self.by_idempotency_key.get(idempotency_key) if idempotency_key else None
+        reminder_id = reminder_id or self.by_task.get((user_id, time_expression, task_hash(title, task)))
+        return self.reminders.get(reminder_id)
+
+    # returns (reminder, created), an existing reminder for the same idempotency key or the
+    # same user, time, title and task is returned instead of creating a duplicate
+    def add(self, user_id, title, task, time_expression, zone, rep, idempotency_key=None, correlation_id=None):
+        with self.condition:
+            reminder = self.existing(user_id, title, task, time_expression, idempotency_key)
+            if reminder:
+                return dict(reminder), False
+
+        next_fire = next_fire_time(time_expression, zone, datetime.now(timezone.utc))
+        if next_fire is None:
+            raise ValueError(f'Cron expression never fires: {time_expression}')
+        reminder = {'id': uuid.uuid4().hex, 'user_id': user_id, 'title': title, 'task': task,
+                    'time_expression': time_expression, 'timezone': zone, 'rep': bool(rep),
+                    'next_fire': next_fire.timestamp(), 'idempotency_key': idempotency_key, 'correlation_id': correlation_id}
+        with self.condition:
+            existing = self.existing(user_id, title, task, time_expression, idempotency_key)
+            if existing:  # created concurrently while the fire time was computed
+                return dict(existing), False
+            self.save(reminder)
+            self.reminders[reminder['id']] = reminder
+            self.register(reminder)
+            self.index_add(reminder)
+            heapq.heappush(self.heap, (reminder['next_fire'], reminder['id']))
+            self.condition.notify()  # the new reminder may be due before the one the timer waits for
+        return dict(reminder), True
+
+    # heap entries of removed reminders are skipped lazily when they come up
+    def remove(self, reminder_id):
+        with self.condition:
+            reminder = self.reminders.pop(reminder_id, None)
+            if reminder:
+                self.unregister(reminder)
+                self.delete(reminder_id)
+        return reminder
+
+    # cancel every reminder of a user at a time, deleting twice is a no-op
+    def remove_at(self, user_id, time_expression):
+        with self.condition:
+            reminder_ids = list(self.by_time.get((user_id, time_expression), ()))
+            return [self.remove(reminder_id) for reminder_id in reminder_ids]
+
+    # pending reminders of a user in fire order
+    def upcoming(self, user_id, limit=None):
+        with self.condition:
+            fires = self.user_fires.get(user_id, [])[:limit]
+            return [dict(self.reminders[reminder_id]) for _, reminder_id in fires]
+
+    def upcoming_many(self, user_ids, limit=None):
+        return {user_id: self.upcoming(user_id, limit) for user_id in user_ids}
+
+    # due reminders leave the heap but stay stored until complete() gets their outcome
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire, reminder_id = heapq.heappop(self.heap)
+            reminder = self.reminders.get(reminder_id)
+            if reminder is None or reminder['next_fire'] != fire or reminder_id in self.in_flight:
+                continue  # removed, rescheduled or already being sent
+            self.in_flight.add(reminder_id)
+            # occurrence: the cron fire time being sent, unchanged by retries (delivery keys on it)
+            _, occurrence, batch = self.attempts.get(reminder_id, (0, fire, None))
+            due.append(dict(reminder, occurrence=occurrence, batch=batch))
+        return due
+
+    def reschedule(self, reminder, next_fire):
+        self.index_remove(reminder)
+        reminder['next_fire'] = next_fire
+        heapq.heappush(self.heap, (next_fire, reminder['id']))
+        self.index_add(reminder)
+        self.save(reminder)
+
+    # outcome of sending reminders handed to dispatch: 'sent', 'rejected' (LINE refused them for
+    # good, e.g. the user blocked the bot) or 'failed' (transient error, try again later)
+    def complete(self, reminders, outcome):
+        with self.condition:
+            now = time.time()  # one retry time for the whole call, its reminders come due in the same tick
+            for sent in reminders:
+                reminder_id = sent['id']
+                self.in_flight.discard(reminder_id)
+                reminder = self.reminders.get(reminder_id)
+                if reminder is None or reminder['next_fire'] != sent['next_fire']:
+                    continue  # cancelled or replaced while being sent
+                if outcome == 'failed':
+                    attempts = self.attempts.get(reminder_id, (0,))[0] + 1
+                    if attempts < self.max_attempts:
+                        self.attempts[reminder_id] = (attempts, sent['occurrence'], sent.get('batch'))
+                        self.reschedule(reminder, now + self.retry_delay * 2 ** (attempts - 1))
+                        continue
+                    print(f"Error sending reminder {reminder_id}: giving up after {attempts} attempts")
+                self.attempts.pop(reminder_id, None)
+                if reminder['rep']:
+                    next_fire = next_fire_time(reminder['time_expression'], reminder['timezone'],
+                                               datetime.fromtimestamp(reminder['next_fire'] + 60, timezone.utc))
+                    self.reschedule(reminder, next_fire.timestamp())
+                else:
+                    del self.reminders[reminder_id]
+                    self.unregister(reminder)
+                    self.delete(reminder_id)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                now = time.time()
+                due = self.pop_due(now)
+                if not due:
+                    timeout = self.heap[0][0] - now if self.heap else None
+                    self.condition.wait(timeout)
+                    continue
+            try:
+                self.dispatch(due, self.complete)
+            except Exception as e:
+                print(f"Error sending {len(due)} reminder(s): {e}")
+                self.complete(due, 'failed')
+
+    def metrics(self):
+        with self.condition:
+            return {'pending': len(self.reminders), 'heap': len(self.heap), 'in_flight': len(self.in_flight),
+                    'retrying': len(self.attempts), 'next_fire': self.heap[0][0] if self.heap else None}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Services import their modules by plain name (see the Dockerfiles), with the repo root on the path for common/
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [service_dir, os.path.dirname(service_dir)]
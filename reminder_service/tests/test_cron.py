@@ -0,0 +1,62 @@
+import random
+import pytest
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from cron import compile_cron, next_fire_time, fire_times
+
+
+def at(zone, *fields):
+    return datetime(*fields, tzinfo=ZoneInfo(zone))
+
+
+# reference: step through wall times minute by minute (day by day on days that don't match)
+def brute_force(expression, zone, after):
+    cron = compile_cron(expression)
+    local = after.astimezone(ZoneInfo(zone)).replace(second=0, microsecond=0, tzinfo=None)
+    while local.year < after.year + 2:
+        if not (cron.months >> local.month & 1 and cron.day_matches(local.year, local.month, local.day)):
+            local = local.replace(hour=0, minute=0) + timedelta(days=1)
+        elif cron.minutes >> local.minute & 1 and cron.hours >> local.hour & 1:
+            return local
+        else:
+            local += timedelta(minutes=1)
+    return None
+
+
+def test_one_shot_and_weekly_expressions():
+    after = at('Asia/Taipei', 2026, 10, 18, 12, 0)  # a Sunday
+    assert next_fire_time('0 16 22 6 *', 'Asia/Taipei', after) == at('Asia/Taipei', 2027, 6, 22, 16, 0)
+    assert next_fire_time('15 3 * * 5', 'Asia/Taipei', after) == at('Asia/Taipei', 2026, 10, 23, 3, 15)
+    assert next_fire_time('0 12 * * 0', 'Asia/Taipei', after) == after  # the current minute still counts
+    assert next_fire_time('0 12 * * 7', 'Asia/Taipei', after) == after
+
+
+def test_matches_a_minute_by_minute_scan():
+    rng = random.Random(7)
+    expressions = ['15 3 * * 5', '0 9 1 1 *', '*/20 8-10 * * 1-5', '30 23 31 * *', '0 0 * 2 *', '5 4 13 * 5']
+    for expression in expressions:
+        for _ in range(20):
+            after = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randrange(2 * 366 * 24 * 60))
+            expected = brute_force(expression, 'Asia/Taipei', after)
+            assert next_fire_time(expression, 'Asia/Taipei', after).replace(tzinfo=None) == expected, (expression, after)
+
+
+def test_leap_day_and_impossible_dates():
+    assert next_fire_time('0 9 29 2 *', 'Asia/Taipei', at('Asia/Taipei', 2026, 3, 1)) == at('Asia/Taipei', 2028, 2, 29, 9, 0)
+    assert next_fire_time('0 9 30 2 *', 'Asia/Taipei', at('Asia/Taipei', 2026, 3, 1)) is None
+    with pytest.raises(ValueError):
+        compile_cron('0 25 * * *')
+    with pytest.raises(ValueError):
+        compile_cron('0 9 * *')
+
+
+def test_dst_transitions():
+    zone = 'America/New_York'
+    # 2:30 doesn't exist on 2026-03-08, clocks jump from 2:00 to 3:00
+    skipped = next_fire_time('30 2 8 3 *', zone, at(zone, 2026, 3, 1))
+    assert skipped.astimezone(timezone.utc) == datetime(2026, 3, 8, 7, 30, tzinfo=timezone.utc)
+    # 1:30 happens twice on 2026-11-01, a daily reminder fires once that day
+    fires = fire_times('30 1 * * *', zone, at(zone, 2026, 10, 31, 12, 0), 3)
+    assert [fire.astimezone(timezone.utc) for fire in fires] == [datetime(2026, 11, 1, 5, 30, tzinfo=timezone.utc),
+                                                                 datetime(2026, 11, 2, 6, 30, tzinfo=timezone.utc),
+                                                                 datetime(2026, 11, 3, 6, 30, tzinfo=timezone.utc)]
@@ -0,0 +1,84 @@
+from concurrent.futures import wait
+from linebot.exceptions import LineBotApiError
+from linebot.models.error import Error
+from delivery import ReminderDelivery
+from scheduler import ReminderScheduler
+
+
+def line_error(status_code):
+    return LineBotApiError(status_code, {}, error=Error(message=f'status {status_code}'))
+
+
+# LINE client recording every call, failures are taken from `errors` in order, then calls succeed
+class FakeLineApi:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    def call(self, kind, to, message, retry_key):
+        self.calls.append((kind, to, message.text, retry_key))
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def multicast(self, to, message, retry_key=None):
+        self.call('multicast', sorted(to), message, retry_key)
+
+    def push_message(self, to, message, retry_key=None):
+        self.call('push', to, message, retry_key)
+
+
+def run_tick(scheduler, delivery):
+    with scheduler.condition:
+        due = scheduler.pop_due(float('inf'))
+    wait(delivery.deliver(due, scheduler.complete))
+    return due
+
+
+def add(scheduler, user_id, time_expression='0 9 1 1 *'):
+    return scheduler.add(user_id, '小明', '開會', time_expression, 'Asia/Taipei', False)[0]
+
+
+def test_failed_multicast_is_retried_as_the_same_call(tmp_path):
+    line = FakeLineApi([TimeoutError('read timed out')])
+    delivery = ReminderDelivery(line, retries=0, backoff=0)
+    scheduler = ReminderScheduler(delivery.deliver, str(tmp_path / 'reminders.db'), retry_delay=60)
+    for user_id in ('U1', 'U2', 'U3'):
+        add(scheduler, user_id)
+    run_tick(scheduler, delivery)
+
+    retry_fires = {reminder['next_fire'] for reminder in scheduler.reminders.values()}
+    assert len(retry_fires) == 1  # the whole call comes due again in one tick
+    add(scheduler, 'U4', '0 10 1 1 *')  # same text, not part of the failed call
+    run_tick(scheduler, delivery)
+
+    first, retry, new = line.calls[0], line.calls[1], line.calls[2]
+    assert first[:2] == ('multicast', ['U1', 'U2', 'U3'])
+    assert retry == first
+    assert new[:2] == ('push', 'U4') and new[3] != first[3]
+    assert not scheduler.reminders
+
+
+def test_transient_errors_are_retried_with_one_key_and_rejections_are_final(tmp_path):
+    line = FakeLineApi([line_error(500), ConnectionError('reset'), line_error(403)])
+    delivery = ReminderDelivery(line, retries=3, backoff=0)
+    scheduler = ReminderScheduler(delivery.deliver, str(tmp_path / 'reminders.db'))
+    add(scheduler, 'U1')
+    run_tick(scheduler, delivery)
+
+    assert len(line.calls) == 3
+    assert len({call[3] for call in line.calls}) == 1
+    assert delivery.metrics()['retried'] == 2 and delivery.metrics()['rejected'] == 1
+    assert not scheduler.reminders  # the user blocked the bot, not tried again
+
+
+def test_scheduler_gives_up_after_max_attempts(tmp_path):
+    line = FakeLineApi([line_error(503)] * 6)
+    delivery = ReminderDelivery(line, retries=1, backoff=0)
+    scheduler = ReminderScheduler(delivery.deliver, str(tmp_path / 'reminders.db'), max_attempts=3)
+    add(scheduler, 'U1')
+    for _ in range(3):
+        run_tick(scheduler, delivery)
+
+    assert len(line.calls) == 6
+    assert len({call[3] for call in line.calls}) == 1
+    assert not scheduler.reminders and not scheduler.attempts
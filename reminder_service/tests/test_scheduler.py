@@ -0,0 +1,126 @@
+import time
+import pytest
+from datetime import datetime, timezone
+from scheduler import ReminderScheduler
+from cron import next_fire_time
+
+
+# dispatch that only records the due reminders, tests report outcomes through complete()
+class RecordingDispatch:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, reminders, complete):
+        self.calls.append(reminders)
+
+
+def new_scheduler(tmp_path, **options):
+    return ReminderScheduler(RecordingDispatch(), str(tmp_path / 'reminders.db'), **options)
+
+
+def pop_all(scheduler):
+    with scheduler.condition:
+        return scheduler.pop_due(float('inf'))
+
+
+def test_duplicates_return_the_existing_reminder(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    first, created = scheduler.add('U1', '小明', '開會', '0 9 1 1 *', 'Asia/Taipei', False)
+    assert created
+    assert scheduler.add('U1', '小明', '開會', '0 9 1 1 *', 'Asia/Taipei', False) == (first, False)
+    # same task and time for someone else in a group is a different reminder
+    assert scheduler.add('U1', '小華', '開會', '0 9 1 1 *', 'Asia/Taipei', False)[1]
+    # a retried webhook with the same idempotency key gets its reminder back, whatever the text
+    keyed, _ = scheduler.add('U1', '小明', '吃飯', '0 12 1 1 *', 'Asia/Taipei', False, idempotency_key='m1')
+    assert scheduler.add('U1', '小明', '吃飯 ', '0 12 1 1 *', 'Asia/Taipei', False, idempotency_key='m1') == (keyed, False)
+    assert len(scheduler.reminders) == 3
+
+
+def test_invalid_expressions_are_rejected(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    with pytest.raises(ValueError):
+        scheduler.add('U1', '小明', '開會', '0 9 30 2 *', 'Asia/Taipei', False)
+    with pytest.raises(ValueError):
+        scheduler.add('U1', '小明', '開會', 'every day', 'Asia/Taipei', False)
+    assert not scheduler.reminders
+
+
+def test_remove_at_cancels_every_reminder_at_that_time(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    for title in ('小明', '小華'):
+        scheduler.add('U1', title, '開會', '0 9 1 1 *', 'Asia/Taipei', False)
+    kept, _ = scheduler.add('U1', '小明', '開會', '0 10 1 1 *', 'Asia/Taipei', False)
+
+    assert len(scheduler.remove_at('U1', '0 9 1 1 *')) == 2
+    assert scheduler.remove_at('U1', '0 9 1 1 *') == []
+    assert scheduler.upcoming('U1') == [kept]
+    assert [reminder['id'] for reminder in pop_all(scheduler)] == [kept['id']]
+
+
+def test_reminders_and_indexes_are_reloaded_from_sqlite(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    later, _ = scheduler.add('U1', '小明', '開會', '0 10 1 1 *', 'Asia/Taipei', True, idempotency_key='m2')
+    sooner, _ = scheduler.add('U1', '小明', '吃飯', '0 9 1 1 *', 'Asia/Taipei', False)
+    scheduler.conn.close()
+
+    reloaded = new_scheduler(tmp_path)
+    assert reloaded.upcoming('U1') == [sooner, later]
+    assert reloaded.add('U1', '小明', '開會', '0 10 1 1 *', 'Asia/Taipei', True) == (later, False)
+    assert reloaded.add('U2', '', '', '0 11 1 1 *', 'Asia/Taipei', False, idempotency_key='m2') == (later, False)
+    assert len(reloaded.remove_at('U1', '0 9 1 1 *')) == 1
+
+
+def test_sent_one_shot_is_removed_and_repeating_advances(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    once, _ = scheduler.add('U1', '小明', '開會', '0 9 1 1 *', 'Asia/Taipei', False)
+    weekly, _ = scheduler.add('U1', '小明', '運動', '0 16 * * 2', 'Asia/Taipei', True)
+    due = pop_all(scheduler)
+    assert scheduler.metrics()['in_flight'] == 2
+    assert pop_all(scheduler) == []  # not handed out twice while being sent
+
+    scheduler.complete(due, 'sent')
+    expected = next_fire_time('0 16 * * 2', 'Asia/Taipei', datetime.fromtimestamp(weekly['next_fire'] + 60, timezone.utc))
+    assert list(scheduler.reminders) == [weekly['id']]
+    assert scheduler.reminders[weekly['id']]['next_fire'] == expected.timestamp()
+    assert new_scheduler(tmp_path).upcoming('U1')[0]['next_fire'] == expected.timestamp()
+    assert scheduler.remove(once['id']) is None
+
+
+def test_failed_reminders_back_off_and_keep_their_occurrence(tmp_path):
+    scheduler = new_scheduler(tmp_path, retry_delay=60, max_attempts=3)
+    reminder, _ = scheduler.add('U1', '小明', '開會', '0 9 1 1 *', 'Asia/Taipei', False)
+    delays = []
+    for _ in range(2):
+        due = pop_all(scheduler)
+        assert due[0]['occurrence'] == reminder['next_fire']
+        before = time.time()
+        scheduler.complete(due, 'failed')
+        delays.append(scheduler.reminders[reminder['id']]['next_fire'] - before)
+    assert [round(delay) for delay in delays] == [60, 120]
+    assert scheduler.metrics()['retrying'] == 1
+
+    scheduler.complete(pop_all(scheduler), 'failed')  # third failed attempt, given up
+    assert not scheduler.reminders and not scheduler.attempts
+
+
+def test_reminder_cancelled_while_being_sent_stays_cancelled(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    scheduler.add('U1', '小明', '運動', '0 16 * * 2', 'Asia/Taipei', True)
+    due = pop_all(scheduler)
+    scheduler.remove_at('U1', '0 16 * * 2')
+    scheduler.complete(due, 'failed')
+    assert not scheduler.reminders and not scheduler.in_flight
+    assert new_scheduler(tmp_path).reminders == {}
+
+
+def test_timer_thread_dispatches_due_reminders(tmp_path):
+    scheduler = new_scheduler(tmp_path)
+    reminder, _ = scheduler.add('U1', '小明', '開會', '0 9 1 1 *', 'Asia/Taipei', False)
+    with scheduler.condition:  # make it due now
+        scheduler.reschedule(scheduler.reminders[reminder['id']], time.time())
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while not scheduler.dispatch.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert [[due['id'] for due in call] for call in scheduler.dispatch.calls] == [[reminder['id']]]
@@ -1,71 +1,68 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from flask import Flask, request, jsonify
+from storage import create_user_store
+from common.instrumentation import instrument_app, register_stats
+from common.calendar_tables import resolve_timezone
+from common.warmup import Readiness, add_readiness_route
 
 app = Flask(__name__)
+instrument_app(app, 'user_data_service')
 
-# Load the service account credentials
-def get_gspread_client():
-    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('../data/linebot-reminder-431422-caacdd8a7834.json', scope)
-    client = gspread.authorize(credentials)
-    return client
+user_store = create_user_store()
+register_stats('user_store', user_store.metrics)
 
-# Open the Google Sheet by its name
-def get_sheet(client, sheet_name="Linebot"):
-    return client.open(sheet_name).sheet1
+# Warm the store in the background (client, connections, user cache) so the first request
+# after a restart doesn't pay for it, /ready answers 200 once it's done
+readiness = Readiness()
+readiness.add('user_store', user_store.warm_up)
+readiness.start()
+add_readiness_route(app, readiness)
 
 # Function to get user data
 @app.route('/user/<user_id>', methods=['GET'])
 def get_user_data(user_id):
-    client = get_gspread_client()
-    sheet = get_sheet(client)
-    data = sheet.get_all_records()
-    for row in data:
-        if row['user_id'] == user_id:
-            return jsonify(row)
+    user = user_store.get_user(user_id)
+    if user:
+        return jsonify(user)
     return jsonify({'message': 'User not found'}), 404
 
+# Function to get several users at once, body: {"user_ids": [...]}
+@app.route('/users', methods=['POST'])
+def get_users_data():
+    user_ids = (request.get_json(silent=True) or {}).get('user_ids', [])
+    return jsonify({'users': user_store.get_users(user_ids)})
+
+# Function to get a user, or create it with defaults in the same call
+# body: {"title": "...", "timezone": "Asia/Taipei"}
+@app.route('/user/<user_id>/ensure', methods=['POST'])
+def ensure_user_data(user_id):
+    request_data = request.get_json(silent=True) or {}
+    user, created = user_store.ensure_user(user_id, request_data.get('title'), request_data.get('timezone') or 'Asia/Taipei')
+    return jsonify(user), 201 if created else 200
+
 # Function to update user's title
 @app.route('/user/<user_id>/title', methods=['PUT'])
 def update_user_title(user_id, title=None):
-    client = get_gspread_client()
-    sheet = get_sheet(client)
-    data = sheet.get_all_records()
-    row_index = 2  # Starting from 2 because get_all_records() skips the header
-    for row in data:
-        if row['user_id'] == user_id:
-            if title:
-                sheet.update_cell(row_index, 2, title)  # Update title
-            return jsonify({'message': 'User found, title updated'}), 200
-        row_index += 1
-    
-    # If user_id not found, append a new row
-    new_row = [user_id, title, 'Asia/Taipei']
-    sheet.append_row(new_row)
-    return jsonify({'message': 'User not found, new row added'}), 201
+    title = title or (request.get_json(silent=True) or {}).get('title')
+    if user_store.upsert_title(user_id, title):
+        return jsonify({'message': 'User not found, new row added'}), 201
+    return jsonify({'message': 'User found, title updated'}), 200
 
 # Function to update user's timezone
 @app.route('/user/<user_id>/timezone', methods=['PUT'])
 def update_user_timezone(user_id, timezone=None, title=None):
-    client = get_gspread_client()
-    sheet = get_sheet(client)
-    timezone_dict = {"台灣": "Asia/Taipei", "美東": "America/New_York", "美西": "America/Los_Angeles", "日本": "Asia/Tokyo"}
-    data = sheet.get_all_records()
-    row_index = 2  # Starting from 2 because get_all_records() skips the header
-    for row in data:
-        if row['user_id'] == user_id:
-            if timezone:
-                timezone = timezone_dict.get(timezone, timezone)
-                sheet.update_cell(row_index, 3, timezone)  # Update timezone
-            return jsonify({'message': 'User found, timezone updated'}), 200
-        row_index += 1
-    
-    # If user_id not found, append a new row
-    timezone = timezone_dict.get(timezone, timezone)
-    new_row = [user_id, title, timezone]
-    sheet.append_row(new_row)
-    return jsonify({'message': 'User not found, new row added'}), 201
+    request_data = request.get_json(silent=True) or {}
+    timezone = timezone or request_data.get('timezone')
+    title = title or request_data.get('title')
+    timezone = resolve_timezone(timezone)
+    if user_store.upsert_timezone(user_id, timezone, title):
+        return jsonify({'message': 'User not found, new row added'}), 201
+    return jsonify({'message': 'User found, timezone updated'}), 200
+
+# Force a reload of cached users, e.g. after editing the sheet by hand
+@app.route('/cache/refresh', methods=['POST'])
+def refresh_user_cache():
+    user_store.refresh()
+    return jsonify({'message': 'User cache reloaded'}), 200
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,303 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from common.instrumentation import time_downstream
+
+
+# Storage interface for user records {'user_id', 'title', 'timezone'}
+# upsert_* return True when a new user was created, False when an existing one was updated
+class UserStore:
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def get_users(self, user_ids):
+        raise NotImplementedError
+
+    def upsert_title(self, user_id, title):
+        raise NotImplementedError
+
+    def upsert_timezone(self, user_id, timezone, title=None):
+        raise NotImplementedError
+
+    # return (record, created), creating the user with the given defaults if missing.
+    # A given title is also stored for an existing user that has none yet.
+    def ensure_user(self, user_id, title, timezone='Asia/Taipei'):
+        raise NotImplementedError
+
+    def refresh(self):
+        pass
+
+    # called once at startup so the first request doesn't pay for connections and loading
+    def warm_up(self):
+        pass
+
+    def metrics(self):
+        return {}
+
+
+GSPREAD_KEY_FILE = os.getenv('GSPREAD_KEY_FILE', '../data/linebot-reminder-431422-caacdd8a7834.json')
+GSPREAD_POOL_SIZE = int(os.getenv('GSPREAD_POOL_SIZE', '10'))
+# One gspread client and worksheet handle per worker process, shared by all request threads.
+# google-auth credentials refresh the access token before it expires, and the AuthorizedSession
+# keeps a pool of keep-alive connections to the Google APIs.
+gspread_state = {'pid': None, 'client': None, 'sheets': {}}
+gspread_lock = threading.Lock()
+
+# Load the service account credentials. gspread and google-auth are imported here rather than at
+# the top, the SQLite store never loads them and the Sheets store loads them during warm-up.
+def get_gspread_client():
+    if gspread_state['pid'] != os.getpid():  # not built yet, or inherited from a parent before fork
+        with gspread_lock:
+            if gspread_state['pid'] != os.getpid():
+                import gspread
+                from google.oauth2.service_account import Credentials
+                from google.auth.transport.requests import AuthorizedSession
+                from requests.adapters import HTTPAdapter
+                scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+                credentials = Credentials.from_service_account_file(GSPREAD_KEY_FILE, scopes=scope)
+                session = AuthorizedSession(credentials)
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=GSPREAD_POOL_SIZE)
+                session.mount('https://', adapter)
+                gspread_state['client'] = gspread.authorize(credentials, session=session)
+                gspread_state['sheets'] = {}
+                gspread_state['pid'] = os.getpid()
+    return gspread_state['client']
+
+# Open the Google Sheet by its name
+def get_sheet(client, sheet_name="Linebot"):
+    sheet = gspread_state['sheets'].get(sheet_name)
+    if sheet is None:
+        with time_downstream('sheets', 'open'):
+            sheet = client.open(sheet_name).sheet1
+        gspread_state['sheets'][sheet_name] = sheet
+    return sheet
+
+
+# Row number of an append_row response, e.g. updatedRange "Linebot!A12:C12" -> 12
+def appended_row(response):
+    return int(re.search(r'!\D*(\d+)', response['updates']['updatedRange']).group(1))
+
+
+# Google Sheets backend with a process-level cache: user_id -> (row_index, record), loaded once
+# from the sheet and updated write-through on upserts. Reloaded after cache_ttl seconds to pick
+# up changes made to the sheet outside this service.
+# Several replicas append to the same sheet, so row numbers only come from the sheet itself
+# (a reload, a read or the append response). A user missing from the cache is looked for in the
+# rows below the last row this replica has read, which other replicas appended since, and a
+# cached row is checked with a one-cell read before it is updated. Only a row that moved (the
+# sheet was edited by hand) makes a search through the whole sheet.
+class SheetsUserStore(UserStore):
+    def __init__(self, sheet_name="Linebot", cache_ttl=300):
+        self.sheet_name = sheet_name
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.last_row = 1  # last row read from the sheet, row 1 is the header
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.ensure_lock = threading.Lock()
+
+    def sheet(self):
+        return get_sheet(get_gspread_client(), self.sheet_name)
+
+    def refresh(self):
+        sheet = self.sheet()
+        with time_downstream('sheets', 'get_all_records'):
+            data = sheet.get_all_records()
+        with self.lock:
+            self.cache.clear()
+            row_index = 2  # Starting from 2 because get_all_records() skips the header
+            for row in data:
+                self.cache[row['user_id']] = (row_index, row)
+                row_index += 1
+            self.last_row = row_index - 1
+            self.loaded_at = time.monotonic()
+
+    def stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.cache_ttl
+
+    def cached(self, user_id):
+        if self.stale():
+            with self.refresh_lock:  # concurrent requests wait for a single reload
+                if self.stale():
+                    self.refresh()
+        return self.cache.get(user_id)
+
+    def warm_up(self):
+        with self.refresh_lock:
+            self.refresh()
+
+    def metrics(self):
+        age = time.monotonic() - self.loaded_at if self.loaded_at is not None else -1
+        return {'cached_users': len(self.cache), 'cache_age_seconds': age}
+
+    def find_row(self, user_id):
+        with time_downstream('sheets', 'find'):
+            cell = self.sheet().find(user_id, in_column=1)
+        return cell.row if cell else None
+
+    # Read the rows appended after last_row (by other replicas or by hand) into the cache.
+    # Rows this replica appended itself don't move last_row, other replicas may have appended above them.
+    def read_new_rows(self):
+        first_row = self.last_row + 1
+        with time_downstream('sheets', 'get_new_rows'):
+            rows = self.sheet().get(f'A{first_row}:C')
+        with self.lock:
+            for row_index, values in enumerate(rows, first_row):
+                values = list(values) + [''] * (3 - len(values))
+                if values[0]:
+                    self.cache[values[0]] = (row_index, {'user_id': values[0], 'title': values[1], 'timezone': values[2]})
+            self.last_row = max(self.last_row, first_row + len(rows) - 1)
+
+    # Cached record of the user, or the user's row read from the sheet when another replica added it
+    def lookup(self, user_id):
+        cached = self.cached(user_id)
+        if cached:
+            return cached
+        self.read_new_rows()
+        return self.cache.get(user_id)
+
+    # Row of a cached user, checked with a one-cell read, searched for only when it moved
+    def current_row(self, user_id):
+        row_index = self.cache[user_id][0]
+        with time_downstream('sheets', 'cell'):
+            if self.sheet().cell(row_index, 1).value == user_id:
+                return row_index
+        return self.find_row(user_id)
+
+    def update(self, user_id, column, field, value):
+        row_index = self.current_row(user_id)
+        record = dict(self.cache[user_id][1])
+        record[field] = value
+        if row_index is None:  # removed from the sheet by hand, add it back
+            self.append(user_id, record['title'], record['timezone'])
+            return
+        with time_downstream('sheets', 'update_cell'):
+            self.sheet().update_cell(row_index, column, value)
+        with self.lock:
+            self.cache[user_id] = (row_index, record)
+
+    def append(self, user_id, title, timezone):
+        sheet = self.sheet()
+        with time_downstream('sheets', 'append_row'):
+            response = sheet.append_row([user_id, title, timezone])
+        with self.lock:
+            self.cache[user_id] = (appended_row(response), {'user_id': user_id, 'title': title, 'timezone': timezone})
+
+    def get_user(self, user_id):
+        cached = self.lookup(user_id)
+        return cached[1] if cached else None
+
+    # users missing from the cache are looked for with a single read of the new rows
+    def get_users(self, user_ids):
+        users = {}
+        missing = []
+        for user_id in user_ids:
+            cached = self.cached(user_id)
+            if cached:
+                users[user_id] = cached[1]
+            else:
+                missing.append(user_id)
+        if missing:
+            self.read_new_rows()
+            for user_id in missing:
+                cached = self.cache.get(user_id)
+                if cached:
+                    users[user_id] = cached[1]
+        return users
+
+    def upsert_title(self, user_id, title):
+        if self.lookup(user_id):
+            if title:
+                self.update(user_id, 2, 'title', title)  # Update title
+            return False
+        self.append(user_id, title, 'Asia/Taipei')
+        return True
+
+    def upsert_timezone(self, user_id, timezone, title=None):
+        if self.lookup(user_id):
+            if timezone:
+                self.update(user_id, 3, 'timezone', timezone)  # Update timezone
+            return False
+        self.append(user_id, title, timezone)
+        return True
+
+    def ensure_user(self, user_id, title, timezone='Asia/Taipei'):
+        with self.ensure_lock:  # one append per new user even with concurrent first messages
+            cached = self.lookup(user_id)
+            if cached:
+                if title and not cached[1].get('title'):
+                    self.update(user_id, 2, 'title', title)
+                return self.cache[user_id][1], False
+            self.append(user_id, title, timezone)
+            return self.cache[user_id][1], True
+
+
+# Local SQLite backend (WAL mode, user_id primary key), for load tests and offline runs
+class SqliteUserStore(UserStore):
+    def __init__(self, path='users.db'):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, title TEXT, timezone TEXT)')
+
+    # one connection per thread, sqlite3 connections can't be shared across threads
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def get_user(self, user_id):
+        row = self.connection().execute('SELECT user_id, title, timezone FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_users(self, user_ids):
+        user_ids = list(user_ids)
+        users = {}
+        for i in range(0, len(user_ids), 500):  # stay below SQLite's host parameter limit
+            chunk = user_ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection().execute(f'SELECT user_id, title, timezone FROM users WHERE user_id IN ({placeholders})', chunk)
+            for row in rows:
+                users[row['user_id']] = dict(row)
+        return users
+
+    def upsert(self, user_id, field, value, new_row):
+        with self.connection() as conn:
+            cursor = conn.execute('INSERT INTO users (user_id, title, timezone) VALUES (?, ?, ?) ON CONFLICT(user_id) DO NOTHING', new_row)
+            if cursor.rowcount:
+                return True
+            if value:
+                conn.execute(f'UPDATE users SET {field} = ? WHERE user_id = ?', (value, user_id))
+            return False
+
+    def ensure_user(self, user_id, title, timezone='Asia/Taipei'):
+        with self.connection() as conn:
+            cursor = conn.execute('INSERT INTO users (user_id, title, timezone) VALUES (?, ?, ?) ON CONFLICT(user_id) DO NOTHING', (user_id, title, timezone))
+            if not cursor.rowcount and title:
+                conn.execute("UPDATE users SET title = ? WHERE user_id = ? AND (title IS NULL OR title = '')", (title, user_id))
+            row = conn.execute('SELECT user_id, title, timezone FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            return dict(row), cursor.rowcount > 0
+
+    def upsert_title(self, user_id, title):
+        return self.upsert(user_id, 'title', title, (user_id, title, 'Asia/Taipei'))
+
+    def upsert_timezone(self, user_id, timezone, title=None):
+        return self.upsert(user_id, 'timezone', timezone, (user_id, title, timezone))
+
+
+# Pick the backend from USER_STORE (sheets or sqlite)
+def create_user_store():
+    backend = os.getenv('USER_STORE', 'sheets')
+    if backend == 'sqlite':
+        return SqliteUserStore(os.getenv('USER_DB_PATH', 'users.db'))
+    if backend == 'sheets':
+        return SheetsUserStore(os.getenv('USER_SHEET_NAME', 'Linebot'), int(os.getenv('USER_CACHE_TTL', '300')))
+    raise ValueError(f'Unknown USER_STORE backend: {backend}')
@@ -0,0 +1,91 @@
+import re
+from types import SimpleNamespace
+from storage import SheetsUserStore
+
+
+# In-memory worksheet with the gspread calls SheetsUserStore makes, counting them
+class FakeSheet:
+    def __init__(self, rows):
+        self.rows = [['user_id', 'title', 'timezone']] + [list(row) for row in rows]
+        self.calls = []
+
+    def get_all_records(self):
+        self.calls.append('get_all_records')
+        return [dict(zip(self.rows[0], row)) for row in self.rows[1:]]
+
+    def get(self, range_name):
+        self.calls.append('get')
+        first_row = int(re.match(r'A(\d+):C$', range_name).group(1))
+        return [list(row) for row in self.rows[first_row - 1:]]
+
+    def cell(self, row, col):
+        self.calls.append('cell')
+        value = self.rows[row - 1][col - 1] if row <= len(self.rows) else None
+        return SimpleNamespace(value=value)
+
+    def find(self, value, in_column):
+        self.calls.append('find')
+        for row_index, row in enumerate(self.rows, 1):
+            if row[in_column - 1] == value:
+                return SimpleNamespace(row=row_index)
+        return None
+
+    def update_cell(self, row, col, value):
+        self.calls.append('update_cell')
+        self.rows[row - 1][col - 1] = value
+
+    def append_row(self, values):
+        self.calls.append('append_row')
+        self.rows.append(list(values))
+        return {'updates': {'updatedRange': f'Linebot!A{len(self.rows)}:C{len(self.rows)}'}}
+
+
+def replica(sheet):
+    store = SheetsUserStore()
+    store.sheet = lambda: sheet
+    store.warm_up()
+    return store
+
+
+def test_user_added_by_another_replica_is_found_without_searching_the_sheet():
+    sheet = FakeSheet([('U1', '小明', 'Asia/Taipei')])
+    a, b = replica(sheet), replica(sheet)
+    assert a.ensure_user('U2', '小華')[1]
+    sheet.calls.clear()
+
+    assert b.get_user('U2') == {'user_id': 'U2', 'title': '小華', 'timezone': 'Asia/Taipei'}
+    assert b.get_users(['U1', 'U2', 'U3']).keys() == {'U1', 'U2'}
+    assert b.ensure_user('U2', 'other') == ({'user_id': 'U2', 'title': '小華', 'timezone': 'Asia/Taipei'}, False)
+    assert 'find' not in sheet.calls and 'get_all_records' not in sheet.calls
+
+
+def test_updates_hit_the_right_row_when_replicas_append_concurrently():
+    sheet = FakeSheet([('U1', '小明', 'Asia/Taipei')])
+    a, b = replica(sheet), replica(sheet)
+    a.ensure_user('U2', 'a')
+    b.ensure_user('U3', 'b')  # b never read row 3 before appending row 4
+    sheet.calls.clear()
+
+    assert not b.upsert_timezone('U3', 'Asia/Tokyo')
+    assert not a.upsert_title('U3', 'c')
+    assert sheet.rows[1:] == [['U1', '小明', 'Asia/Taipei'], ['U2', 'a', 'Asia/Taipei'], ['U3', 'c', 'Asia/Tokyo']]
+    assert 'find' not in sheet.calls
+
+
+def test_row_moved_by_hand_is_searched_for():
+    sheet = FakeSheet([('U1', '小明', 'Asia/Taipei'), ('U2', '小華', 'Asia/Taipei')])
+    store = replica(sheet)
+    del sheet.rows[1]  # U1 removed by hand, U2 moves up to row 2
+
+    assert not store.upsert_title('U2', 'new')
+    assert sheet.rows[1:] == [['U2', 'new', 'Asia/Taipei']]
+    assert 'find' in sheet.calls
+
+
+def test_ensure_stores_the_title_of_a_user_without_one():
+    sheet = FakeSheet([('U1', '', 'Asia/Taipei')])
+    store = replica(sheet)
+
+    assert store.ensure_user('U1', '小明') == ({'user_id': 'U1', 'title': '小明', 'timezone': 'Asia/Taipei'}, False)
+    assert store.ensure_user('U1', 'other')[0]['title'] == '小明'
+    assert sheet.rows[1] == ['U1', '小明', 'Asia/Taipei']